@@ -12,7 +12,6 @@ wesc+api@google.com (Wesley Chun)
 """
 
 import endpoints
-from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from protorpc import messages, message_types, remote
 
@@ -20,26 +19,28 @@ from models.conference import Conference, ConferenceForm, ConferenceForms, \
     ConferenceQueryForms
 from models.conference_session import ConferenceSessionForms, \
     ConferenceSessionForm, ConferenceSessionQueryForms
-from models.models import ConflictException, StringMessage, BooleanMessage
-from models.profile import Profile, ProfileMiniForm, ProfileForm
-from models.speaker import SpeakerForms
+from models.models import StringMessage, BooleanMessage, \
+    CacheStatsForm, CacheStatsForms
+from models.profile import ProfileMiniForm, ProfileForm
+from models.registration import AttendeeForms
+from models.speaker import SpeakerForms, FeaturedSpeakerForm
 from models.wishlist import WishlistForm
-from services.conference_service import ConferenceService
+from services.conference_service import ConferenceService, \
+    conference_query_cache
 from services.profile_service import ProfileService
+from services.registration_service import RegistrationService
 from services.session_service import SessionService
 from services.speaker_service import SpeakerService
 from services.wishlist_service import WishlistService
 from settings import WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID, \
     ANDROID_AUDIENCE
-from support.AppliesFilters import AppliesFilters
+from support.AnnouncesConferences import AnnouncesConferences
 from support.Auth import Auth
-from support.FeaturesSpeakers import MEMCACHE_FEATURED_SPEAKER_KEY
+from support.CachesInMemory import CachesInMemory
+from support.FeaturesSpeakers import get_featured_speaker
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {"city": "Default City", "maxAttendees": 0, "seatsAvailable": 0,
@@ -50,10 +51,25 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1, required=True)
 )
 
+PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2)
+)
+
+CONF_PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1, required=True),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3)
+)
+
 CONF_SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1, required=True),
-    sessionType=messages.StringField(2)
+    sessionType=messages.StringField(2),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4)
 )
 
 CONF_POST_REQUEST = endpoints.ResourceContainer(
@@ -61,9 +77,21 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1, required=True)
 )
 
+CONF_SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    ConferenceSessionForms,
+    websafeConferenceKey=messages.StringField(3, required=True)
+)
+
 CONF_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
-    websafeSpeakerKey=messages.StringField(1, required=True)
+    websafeSpeakerKey=messages.StringField(1, required=True),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3)
+)
+
+SESSION_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1, required=True)
 )
 
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
@@ -88,6 +116,7 @@ class ConferenceApi(remote.Service):
         self.conference_service = ConferenceService()
         self.wishlist_service = WishlistService()
         self.profile_service = ProfileService()
+        self.registration_service = RegistrationService()
         self.auth = Auth()
 
     # - - - Conference objects - - - - - - - - - - - - - - - - -
@@ -116,62 +145,25 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' %
                 request.websafeConferenceKey)
-        prof = conf.key.parent().get()
         # return ConferenceForm
         return self.conference_service.copy_conference_to_form(ConferenceForm(),
-                                                               conf,
-                                                               prof.displayName)
+                                                               conf)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(PAGE_GET_REQUEST, ConferenceForms,
                       path='get-conferences-created', http_method='POST',
                       name='getConferencesCreated')
     def get_conferences_created(self, request):
         """Return conferences created by user."""
-        # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = self.auth.get_user_id(user)
-
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[
-            self.conference_service.copy_conference_to_form(ConferenceForm(),
-                                                            conf,
-                                                            prof.displayName)
-            for conf in confs])
+        return self.conference_service.get_conferences_created(
+            request.pageSize, request.pageToken)
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='query-conferences', http_method='POST',
                       name='queryConferences')
     def query_conferences(self, request):
         """Query for conferences."""
-        filter_maker = AppliesFilters(
-            Conference,
-            {'int': ["month", "maxAttendees"]},
-            {'CITY': 'city', 'TOPIC': 'topics',
-             'MONTH': 'month',
-             'MAX_ATTENDEES': 'maxAttendees'})
-        conferences = filter_maker.get_query(request.filters)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in
-                      conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(items=[
-            self.conference_service.copy_conference_to_form(
-                ConferenceForm(), conf, names[conf.organizerUserId]
-            ) for conf in conferences])
+        return self.conference_service.query_conferences(
+            request.filters, request.pageSize, request.pageToken)
 
     # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
@@ -191,122 +183,50 @@ class ConferenceApi(remote.Service):
 
     @staticmethod
     def cache_announcement():
-        """Create Announcement & assign to memcache; used by
+        """Reconcile Announcement & assign to memcache; used by
         memcache cron job & putAnnouncement().
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5, Conference.seatsAvailable > 0
-        )).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        return AnnouncesConferences.reconcile()
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get', http_method='GET',
                       name='getAnnouncement')
     def get_announcement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(
-            data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        return StringMessage(data=AnnouncesConferences.get())
 
     # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
-    def conference_registration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
-        prof = self.profile_service.get_profile_from_user()  # get user Profile
-
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % wsck)
-
-        # register
-        if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
-
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException("There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
-        # unregister
-        else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
-
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending', http_method='GET',
                       name='getConferencesToAttend')
     def get_conferences_to_attend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self.profile_service.get_profile_from_user()  # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in
-                     prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in
-                      conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[
-            self.conference_service.copy_conference_to_form(
-                ConferenceForm(), conf, names[conf.organizerUserId]
-            ) for conf in conferences])
+        return self.registration_service.get_conferences_to_attend()
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
     def register_for_conference(self, request):
         """Register user for selected conference."""
-        return self.conference_registration(request)
+        return self.registration_service.conference_registration(
+            request.websafeConferenceKey)
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
     def unregister_from_conference(self, request):
         """Unregister user for selected conference."""
-        return self.conference_registration(request, reg=False)
+        return self.registration_service.conference_registration(
+            request.websafeConferenceKey, reg=False)
+
+    @endpoints.method(CONF_PAGE_GET_REQUEST, AttendeeForms,
+                      path='conference/{websafeConferenceKey}/attendees',
+                      http_method='GET', name='getConferenceAttendees')
+    def get_conference_attendees(self, request):
+        """Get the users registered for a conference (organizer only)."""
+        return self.registration_service.get_attendees(
+            request.websafeConferenceKey, request.pageSize, request.pageToken)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='filterPlayground', http_method='GET',
@@ -325,7 +245,7 @@ class ConferenceApi(remote.Service):
 
         return ConferenceForms(items=[
             self.conference_service.copy_conference_to_form(
-                ConferenceForm(), conf, "") for conf in q])
+                ConferenceForm(), conf) for conf in q])
 
     # - - - Conference sessions  - - - - - - - - - - - - - - - - -
     @endpoints.method(ConferenceSessionForm, ConferenceSessionForm,
@@ -341,13 +261,51 @@ class ConferenceApi(remote.Service):
         self.session_service.create_conference_session(request, user)
         return request
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceSessionForms,
+    @endpoints.method(CONF_SESSIONS_POST_REQUEST, ConferenceSessionForms,
+                      path='conference/{websafeConferenceKey}/sessions',
+                      http_method='POST', name='createConferenceSessions')
+    def create_conference_sessions(self, request):
+        """Create a batch of sessions in a conference."""
+        user = endpoints.get_current_user()
+
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        websafe_session_keys = self.session_service.create_conference_sessions(
+            request.websafeConferenceKey, request.items, user)
+
+        for item, websafe_session_key in zip(request.items,
+                                             websafe_session_keys):
+            item.websafeConferenceKey = request.websafeConferenceKey
+            item.websafeSessionKey = websafe_session_key
+        return ConferenceSessionForms(items=request.items)
+
+    @endpoints.method(CONF_PAGE_GET_REQUEST, ConferenceSessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET', name='getConferenceSessions')
     def get_conference_sessions(self, request):
         """Get all the sessions in a conference."""
         return self.session_service.get_conference_sessions(
-            request.websafeConferenceKey)
+            request.websafeConferenceKey, request.pageSize, request.pageToken)
+
+    @endpoints.method(message_types.VoidMessage, CacheStatsForms,
+                      path='cache/stats', http_method='GET',
+                      name='getCacheStats')
+    def get_cache_stats(self, request):
+        """Return hit and miss counters of the result caches and of the
+        in-memory caches, for the instance serving the request."""
+        items = []
+        for name, cache in (('schedule', self.session_service.schedule_cache),
+                            ('conference_query', conference_query_cache)):
+            stats = cache.stats()
+            items.append(CacheStatsForm(name=name, hits=stats['hits'],
+                                        misses=stats['misses']))
+        for name, cache in sorted(CachesInMemory.caches.items()):
+            stats = cache.stats()
+            items.append(CacheStatsForm(
+                name='local:%s' % name, hits=stats['hits'],
+                misses=stats['misses'], evictions=stats['evictions']))
+        return CacheStatsForms(items=items)
 
     @endpoints.method(CONF_SPEAKER_GET_REQUEST, ConferenceSessionForms,
                       path='speaker/{websafeSpeakerKey}/sessions',
@@ -355,7 +313,7 @@ class ConferenceApi(remote.Service):
     def get_speaker_sessions(self, request):
         """Get all the sessions by a speaker, across all conferences."""
         return self.session_service.get_speaker_sessions(
-            request.websafeSpeakerKey)
+            request.websafeSpeakerKey, request.pageSize, request.pageToken)
 
     @endpoints.method(CONF_SESSION_GET_REQUEST, ConferenceSessionForms,
                       path='conference/{websafeConferenceKey}/sessions/{'
@@ -364,7 +322,8 @@ class ConferenceApi(remote.Service):
     def get_sessions_by_type(self, request):
         """Get all the sessions of a particular type in a conference."""
         return self.session_service.get_conference_sessions_by_type(
-            request.websafeConferenceKey, request.sessionType)
+            request.websafeConferenceKey, request.sessionType,
+            request.pageSize, request.pageToken)
 
     @endpoints.method(ConferenceSessionQueryForms, ConferenceSessionForms,
                       path='query-sessions', http_method='POST',
@@ -374,21 +333,31 @@ class ConferenceApi(remote.Service):
         filter it by title, duration, date or start time."""
         return self.session_service.get_sessions_by_type_and_filters(
             request.websafeConferenceKey,
-            request.typeOfSession, request.filters)
+            request.typeOfSession, request.filters, request.pageSize,
+            request.pageToken)
 
-    @endpoints.method(message_types.VoidMessage, SpeakerForms, path='speakers',
+    @endpoints.method(PAGE_GET_REQUEST, SpeakerForms, path='speakers',
                       http_method='GET', name='getSpeakers')
     def get_speakers(self, request):
         """Return a list of all speakers."""
-        return self.speaker_service.get_speakers()
-
-    @endpoints.method(message_types.VoidMessage, StringMessage,
-                      path='speakers/featured', http_method='GET',
-                      name='getFeaturedSpeaker')
+        return self.speaker_service.get_speakers(request.pageSize,
+                                                 request.pageToken)
+
+    @endpoints.method(SESSION_GET_REQUEST, ConferenceSessionForms,
+                      path='session/{websafeSessionKey}/recommended',
+                      http_method='GET', name='getRecommendedSessions')
+    def get_recommended_sessions(self, request):
+        """Get the sessions most often wishlisted along with a session."""
+        return self.session_service.get_recommended_sessions(
+            request.websafeSessionKey)
+
+    @endpoints.method(CONF_GET_REQUEST, FeaturedSpeakerForm,
+                      path='conference/{websafeConferenceKey}/featuredSpeaker',
+                      http_method='GET', name='getFeaturedSpeaker')
     def get_featured_speaker(self, request):
-        """Return featured speaker from memcache."""
-        return StringMessage(
-            data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+        """Return the featured speaker of a conference, from memcache."""
+        return get_featured_speaker(
+            ndb.Key(urlsafe=request.websafeConferenceKey))
 
     @endpoints.method(WISHLIST_POST_REQUEST, WishlistForm, path='wishlist',
                       http_method='POST', name='addToMyWishlist')
@@ -404,15 +373,16 @@ class ConferenceApi(remote.Service):
         return self.wishlist_service.remove_session_from_wishlist(
             request.websafeSessionKey, endpoints.get_current_user())
 
-    @endpoints.method(message_types.VoidMessage, ConferenceSessionForms,
+    @endpoints.method(PAGE_GET_REQUEST, ConferenceSessionForms,
                       path='wishlist', http_method='GET',
                       name='getSessionsInWishlist')
     def get_sessions_in_wishlist(self, request):
         """Get all the sessions this user has saved in their wishlist."""
         user = endpoints.get_current_user()
-        return self.wishlist_service.get_sessions_in_wishlist(user)
+        return self.wishlist_service.get_sessions_in_wishlist(
+            user, request.pageSize, request.pageToken)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceSessionForms,
+    @endpoints.method(PAGE_GET_REQUEST, ConferenceSessionForms,
                       path='wishlist/sessions-by-wishlist-speakers',
                       http_method='GET',
                       name='getSessionsByWishlistSpeakers')
@@ -421,9 +391,9 @@ class ConferenceApi(remote.Service):
         that this user has in their wishlist sessions."""
         user = endpoints.get_current_user()
         return self.wishlist_service.get_sessions_by_speaker_in_wishlist(
-            user)
+            user, request.pageSize, request.pageToken)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceSessionForms,
+    @endpoints.method(PAGE_GET_REQUEST, ConferenceSessionForms,
                       path='wishlist/sessions-by-wishlist-types',
                       http_method='GET',
                       name='getSessionsByWishlistTypes')
@@ -432,7 +402,7 @@ class ConferenceApi(remote.Service):
         this user has in their wishlist sessions."""
         user = endpoints.get_current_user()
         return self.wishlist_service.get_sessions_by_types_in_wishlist(
-            user)
+            user, request.pageSize, request.pageToken)
 
 
 api = endpoints.api_server([ConferenceApi])  # register API
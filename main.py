@@ -16,7 +16,14 @@ import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 from conference import ConferenceApi
-from support.FeaturesSpeakers import FeaturesSpeakers
+from services.conference_service import ConferenceService, \
+    UPDATE_ORGANIZER_NAME_URL
+from support.FeaturesSpeakers import FeaturesSpeakers, FEATURE_SPEAKER_URL
+from support.MigratesEntities import MigratesEntities, MIGRATE_ENTITIES_URL
+from support.RecommendsSessions import RecommendsSessions, \
+    BUILD_RECOMMENDATIONS_URL
+from support.ShardsSeats import ShardsSeats, RECONCILE_SEATS_URL, \
+    AUDIT_SEATS_URL
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
@@ -27,6 +34,46 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class ReconcileSeatsHandler(webapp2.RequestHandler):
+    """Handles the seat reconciliation cron job."""
+    def get(self):
+        """Sync available seats from the seat shards, from the start."""
+        if ShardsSeats.reconcile():
+            ConferenceService.conferences_changed()
+        self.response.set_status(204)
+
+    def post(self):
+        """Sync available seats from the seat shards, from a cursor."""
+        if ShardsSeats.reconcile(self.request.get('cursor')):
+            ConferenceService.conferences_changed()
+
+
+class AuditSeatsHandler(webapp2.RequestHandler):
+    """Handles the seat audit cron job."""
+    def get(self):
+        """Check seats against registrations, from the start."""
+        ShardsSeats.audit()
+        self.response.set_status(204)
+
+    def post(self):
+        """Check seats against registrations, from a cursor."""
+        ShardsSeats.audit(self.request.get('cursor'))
+
+
+class BuildRecommendationsHandler(webapp2.RequestHandler):
+    """Handles the session recommendations cron job."""
+    def get(self):
+        """Rebuild the session recommendations from the wishlists."""
+        RecommendsSessions.start()
+        self.response.set_status(204)
+
+    def post(self):
+        """Run the next chunk of a recommendations run, from a cursor."""
+        RecommendsSessions.run(self.request.get('step'),
+                               self.request.get('started'),
+                               self.request.get('cursor'))
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     """Handles the confirmation email task."""
     def post(self):
@@ -42,8 +89,21 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    """Handles the organizer display name task."""
+    def post(self):
+        """Copy an organizer's new display name onto their conferences."""
+        ConferenceService.update_organizer_display_name(
+            self.request.get('user_id'), self.request.get('cursor'))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    (RECONCILE_SEATS_URL, ReconcileSeatsHandler),
+    (AUDIT_SEATS_URL, AuditSeatsHandler),
+    (BUILD_RECOMMENDATIONS_URL, BuildRecommendationsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/cache_featured_speaker', FeaturesSpeakers),
+    (FEATURE_SPEAKER_URL, FeaturesSpeakers),
+    (UPDATE_ORGANIZER_NAME_URL, UpdateOrganizerNameHandler),
+    (MIGRATE_ENTITIES_URL, MigratesEntities),
 ], debug=True)
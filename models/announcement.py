@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+
+"""announcement.py
+
+Models for the Announcement ndb kind.
+
+"""
+
+from google.appengine.ext import ndb
+
+
+class Announcement(ndb.Model):
+    """Announcement -- the conferences that are nearly sold out.
+
+    There is a single Announcement entity, kept up to date as seats are taken
+    and given back, so the announcement never needs a query over every
+    conference.
+    """
+    conferenceKeys = ndb.KeyProperty('conferences', kind='Conference',
+                                     repeated=True, indexed=False)
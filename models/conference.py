@@ -21,7 +21,9 @@ class Conference(ndb.Model):
     month = ndb.IntegerProperty()  # TODO: do we need for indexing like Java?
     endDate = ndb.DateProperty()
     maxAttendees = ndb.IntegerProperty()
-    seatsAvailable = ndb.IntegerProperty()
+    seatsAvailable = ndb.IntegerProperty()  # synced from seat shards
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+    seatShards = ndb.IntegerProperty(default=0, indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -43,6 +45,7 @@ class ConferenceForm(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -56,3 +59,5 @@ class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form
     message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
@@ -14,8 +14,8 @@ class ConferenceSession(ndb.Model):
     """Session -- Session object"""
     title = ndb.StringProperty(required=True)
     highlights = ndb.TextProperty()
-    websafeConferenceKey = ndb.StringProperty()
-    speakerKeys = ndb.TextProperty(repeated=True, indexed=True)
+    websafeConferenceKey = ndb.StringProperty(indexed=False)
+    speakerKeys = ndb.KeyProperty('speakers', kind='Speaker', repeated=True)
     duration = ndb.IntegerProperty()
     typeOfSession = ndb.StringProperty()
     dateTime = ndb.DateTimeProperty(required=True)
@@ -38,6 +38,7 @@ class ConferenceSessionForm(messages.Message):
 class ConferenceSessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(ConferenceSessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 
 class ConferenceSessionQueryForm(messages.Message):
@@ -55,3 +56,5 @@ class ConferenceSessionQueryForms(messages.Message):
                                     repeated=True)
     typeOfSession = messages.StringField(2, required=True)
     websafeConferenceKey = messages.StringField(3)
+    pageSize = messages.IntegerField(4, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(5)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+"""featured_speaker.py
+
+Models for the FeaturedSpeaker ndb kind.
+
+"""
+
+from google.appengine.ext import ndb
+
+# Every conference has a single featured speaker, with this id, under the
+# Conference
+FEATURED_SPEAKER_ID = 'featured_speaker'
+
+
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- the speaker currently featured in a conference.
+
+    The featured speaker is served from memcache; this is the durable copy it
+    is rebuilt from when evicted. The speaker and their session titles are
+    copied here, so it can be served without reading anything else.
+    """
+    speakerKey = ndb.KeyProperty('speaker', kind='Speaker', indexed=False)
+    name = ndb.StringProperty(indexed=False)
+    email = ndb.StringProperty(indexed=False)
+    sessionTitles = ndb.StringProperty(repeated=True, indexed=False)
@@ -24,3 +24,17 @@ class StringMessage(messages.Message):
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
+
+
+class CacheStatsForm(messages.Message):
+    """CacheStatsForm -- outbound hit, miss and eviction counters of one
+    cache"""
+    name = messages.StringField(1)
+    hits = messages.IntegerField(2)
+    misses = messages.IntegerField(3)
+    evictions = messages.IntegerField(4)
+
+
+class CacheStatsForms(messages.Message):
+    """CacheStatsForms -- multiple CacheStatsForm outbound form message"""
+    items = messages.MessageField(CacheStatsForm, 1, repeated=True)
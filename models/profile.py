@@ -34,7 +34,10 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    # Legacy; registrations are now Registration entities, this is only kept
+    # until MigratesEntities has moved them over
+    conferenceKeysToAttend = ndb.KeyProperty('conferencesToAttend',
+                                             kind='Conference', repeated=True)
 
 
 class ProfileMiniForm(messages.Message):
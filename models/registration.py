@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+"""registration.py
+
+Models for the Registration ndb kind and protorpc messages.
+
+"""
+
+from protorpc import messages
+from google.appengine.ext import ndb
+
+
+class Registration(ndb.Model):
+    """Registration -- a user's registration for a conference.
+
+    Registrations are children of the user's Profile, with the urlsafe
+    conference key as their id, so there is at most one per user and
+    conference and it can be looked up directly.
+    """
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- outbound page of the users attending a conference"""
+    userIds = messages.StringField(1, repeated=True)
+    nextPageToken = messages.StringField(2)
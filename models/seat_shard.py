@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+
+"""seat_shard.py
+
+Models for the SeatShard ndb kind.
+
+"""
+
+from google.appengine.ext import ndb
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- a slice of the seats still available for a conference.
+
+    Shards are root entities, each in its own entity group, so registrations
+    for one conference are spread over several groups instead of all
+    contending on the Conference entity.
+    """
+    seats = ndb.IntegerProperty(default=0, indexed=False)
+    # Set when a registration changes the seats, until the total is synced
+    # onto the conference
+    dirty = ndb.BooleanProperty(default=False)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+"""session_co_occurrence.py
+
+Models for the SessionCoOccurrence ndb kind.
+
+"""
+
+from google.appengine.ext import ndb
+
+
+class SessionCoOccurrence(ndb.Model):
+    """SessionCoOccurrence -- how often each pair of sessions of a conference
+    was wishlisted together, counted so far by a recommendations run.
+
+    There is one entity per conference, with the urlsafe conference key as
+    its id. The counts are added to as the run reads through the wishlists,
+    and the entity is deleted once they are turned into the conference's
+    SessionRecommendations.
+    """
+    # The run the counts belong to, counts of an older run are discarded
+    started = ndb.StringProperty(indexed=False)
+    # int64 session ids, in the order of the rows and columns of counts
+    sessionIds = ndb.BlobProperty()
+    # int32 square matrix of pair counts
+    counts = ndb.BlobProperty(compressed=True)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+"""session_recommendations.py
+
+Models for the SessionRecommendations ndb kind.
+
+"""
+
+from google.appengine.ext import ndb
+
+
+class SessionRecommendations(ndb.Model):
+    """SessionRecommendations -- the sessions most often wishlisted along
+    with each session of a conference.
+
+    There is one entity per conference, with the urlsafe conference key as
+    its id, rebuilt by the recommendations cron job. The sessions are packed
+    into arrays rather than stored as keys, to keep the entity small.
+    """
+    # int64 session ids, in the order of the rows of neighbours
+    sessionIds = ndb.BlobProperty()
+    # int32 rows of indexes into sessionIds, best first, padded with -1
+    neighbours = ndb.BlobProperty(compressed=True)
+    topK = ndb.IntegerProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now=True, indexed=False)
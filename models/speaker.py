@@ -26,3 +26,13 @@ class SpeakerForm(messages.Message):
 class SpeakerForms(messages.Message):
     """Multiple SpeakerForm inbound form message"""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- outbound featured speaker of a conference"""
+    websafeConferenceKey = messages.StringField(1)
+    websafeSpeakerKey = messages.StringField(2)
+    name = messages.StringField(3)
+    email = messages.StringField(4)
+    sessionTitles = messages.StringField(5, repeated=True)
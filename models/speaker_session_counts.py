@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+"""speaker_session_counts.py
+
+Models for the SpeakerSessionCounts ndb kind.
+
+"""
+
+from google.appengine.ext import ndb
+
+# Every conference has a single count, with this id, under the Conference
+SPEAKER_COUNTS_ID = 'speaker_counts'
+
+
+class SpeakerSessionCounts(ndb.Model):
+    """SpeakerSessionCounts -- the number of sessions of each speaker in a
+    conference.
+
+    It is in the conference's entity group, and written in the same
+    transaction as the sessions it counts.
+    """
+    # speaker key id (normalized email) -> number of sessions
+    counts = ndb.JsonProperty(indexed=False)
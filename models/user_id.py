@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+"""user_id.py
+
+Models for the UserId ndb kind.
+
+"""
+
+from google.appengine.ext import ndb
+
+
+class UserId(ndb.Model):
+    """UserId -- the user id assigned to an email address.
+
+    Keyed by the lower case email, and created with get_or_insert, so
+    concurrent requests for a new user always agree on the same id.
+    """
+    userId = ndb.StringProperty(required=True, indexed=False)
@@ -10,9 +10,14 @@ from google.appengine.ext import ndb
 from protorpc import messages
 
 
+# Every user has a single wishlist, with this id, under their Profile
+WISHLIST_ID = 'wishlist'
+
+
 class Wishlist(ndb.Model):
     """Wishlist object"""
-    sessionKeys = ndb.StringProperty(repeated=True)
+    sessionKeys = ndb.KeyProperty('sessions', kind='ConferenceSession',
+                                  repeated=True)
 
 
 class WishlistForm(messages.Message):
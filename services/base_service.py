@@ -12,6 +12,13 @@ API response.
 
 """
 
+import endpoints
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
 
 class BaseService(object):
     """Generic functionality for the service layer."""
@@ -31,9 +38,99 @@ class BaseService(object):
             if (field.name in ['teeShirtSize', 'startDate', 'endDate']):
                 continue
             if hasattr(entity, field.name):
-                setattr(form, field.name, getattr(entity, field.name))
+                setattr(form, field.name,
+                        self.to_websafe(getattr(entity, field.name)))
             elif field.name == "websafeKey":
                 setattr(form, field.name, entity.key.urlsafe())
         form.check_initialized()
 
         return form
+
+    @staticmethod
+    def to_websafe(value):
+        """Convert ndb keys, or lists of keys, to their urlsafe strings.
+
+        Args:
+            value (object)
+
+        Returns:
+            object
+        """
+        if isinstance(value, ndb.Key):
+            return value.urlsafe()
+        if isinstance(value, list):
+            return [BaseService.to_websafe(item) for item in value]
+        return value
+
+    @staticmethod
+    def page_size(page_size=None):
+        """Validate a requested page size, falling back to the default.
+
+        Args:
+            page_size (int)
+
+        Returns:
+            int
+
+        Raises:
+            endpoints.BadRequestException
+        """
+        if page_size is None:
+            return DEFAULT_PAGE_SIZE
+        if page_size < 1:
+            raise endpoints.BadRequestException(
+                "'pageSize' must be a positive number")
+        return min(page_size, MAX_PAGE_SIZE)
+
+    def fetch_page(self, query, page_size=None, page_token=None,
+                   keys_only=False):
+        """Fetch a single page of a query, starting from a page token.
+
+        Args:
+            query (ndb.Query)
+            page_size (int)
+            page_token (string): urlsafe cursor from a previous page
+            keys_only (bool): fetch keys rather than entities
+
+        Returns:
+            tuple: (list of ndb.Model or ndb.Key, next page token or None)
+
+        Raises:
+            endpoints.BadRequestException
+        """
+        try:
+            cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+            results, next_cursor, more = query.fetch_page(
+                self.page_size(page_size), start_cursor=cursor,
+                keys_only=keys_only)
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return results, next_token
+
+    def slice_page(self, items, page_size=None, page_token=None):
+        """Slice a single page out of an in-memory list.
+
+        Args:
+            items (list)
+            page_size (int)
+            page_token (string): offset from a previous page
+
+        Returns:
+            tuple: (list, next page token or None)
+
+        Raises:
+            endpoints.BadRequestException
+        """
+        try:
+            start = int(page_token) if page_token else 0
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+        if start < 0:
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+        end = start + self.page_size(page_size)
+        next_token = str(end) if end < len(items) else None
+        return items[start:end], next_token
@@ -11,14 +11,27 @@ import endpoints
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
-from models.conference import Conference, ConferenceForm
+from models.conference import Conference, ConferenceForm, ConferenceForms
 from models.profile import Profile
 from services.base_service import BaseService
+from support.AnnouncesConferences import AnnouncesConferences
+from support.AppliesFilters import AppliesFilters
 from support.Auth import Auth
+from support.CachesQueries import CachesQueries
+from support.LoadsProfiles import LoadsProfiles
+from support.ShardsSeats import ShardsSeats
 
 DEFAULTS = {"city": "Default City", "maxAttendees": 0, "seatsAvailable": 0,
             "topics": ["Default", "Topic"]}
 
+UPDATE_ORGANIZER_NAME_URL = '/tasks/update_organizer_name'
+ORGANIZER_NAME_BATCH_SIZE = 100
+
+# Every conference query result is cached under a single scope, so any write
+# to a conference invalidates them all.
+CONFERENCES_SCOPE = 'conferences'
+conference_query_cache = CachesQueries('conference_query')
+
 
 class ConferenceService(BaseService):
     """Interface between the client and Conference Data Store."""
@@ -26,22 +39,87 @@ class ConferenceService(BaseService):
     def __init__(self, auth=None):
         self.auth = auth if auth is not None else Auth()
 
-    def copy_conference_to_form(self, form, entity, display_name):
-        """Copies a Conference entity to a ConferenceForm.
+    def copy_conference_to_form(self, form, entity):
+        """Copies a Conference entity to a ConferenceForm. The organizer's
+        display name is stored on the conference.
 
         Args:
             form (ConferenceForm)
             entity (Conference)
-            display_name (string)
 
         Returns:
              ConferenceForm
         """
-        if display_name:
-            form.organizerDisplayName = display_name
-
         return super(ConferenceService, self).copy_entity_to_form(form, entity)
 
+    def get_conferences_created(self, page_size=None, page_token=None):
+        """Gets a page of the conferences created by the current user.
+
+        Args:
+            page_size (int)
+            page_token (string)
+
+        Returns:
+            ConferenceForms
+        """
+        # make sure user is authed
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = self.auth.get_user_id(user)
+
+        # create ancestor query for all key matches for this user
+        p_key = ndb.Key(Profile, user_id)
+        confs, next_token = self.fetch_page(
+            Conference.query(ancestor=p_key), page_size, page_token)
+        # return set of ConferenceForm objects per Conference
+        return ConferenceForms(
+            items=[self.copy_conference_to_form(ConferenceForm(), conf)
+                   for conf in confs],
+            nextPageToken=next_token)
+
+    def query_conferences(self, filters, page_size=None, page_token=None):
+        """Gets a page of the conferences matching the user's filters.
+
+        Args:
+            filters (list of ConferenceQueryForm)
+            page_size (int)
+            page_token (string)
+
+        Returns:
+            ConferenceForms
+        """
+        filter_maker = AppliesFilters(
+            Conference,
+            {'int': ["month", "maxAttendees"]},
+            {'CITY': 'city', 'TOPIC': 'topics',
+             'MONTH': 'month',
+             'MAX_ATTENDEES': 'maxAttendees'})
+        page_size = self.page_size(page_size)
+
+        def get_page():
+            """Run the query, on a cache miss."""
+            conferences, next_token = filter_maker.fetch_page(
+                filters, page_size, page_token)
+
+            # return individual ConferenceForm object per Conference
+            return ConferenceForms(
+                items=[self.copy_conference_to_form(ConferenceForm(), conf)
+                       for conf in conferences],
+                nextPageToken=next_token)
+
+        # The same filters in any order make the same query
+        normalized = sorted((f['field'], f['operator'], f['value'])
+                            for f in filter_maker.format_filters(filters))
+        return conference_query_cache.get(
+            CONFERENCES_SCOPE, (normalized, page_size, page_token),
+            ConferenceForms, get_page)
+
+    @staticmethod
+    def conferences_changed():
+        """Invalidate every cached conference query result."""
+        conference_query_cache.bump(CONFERENCES_SCOPE)
+
     def create_conference_object(self, request):
         """Create or update Conference object, returning
         ConferenceForm/request."""
@@ -85,14 +163,21 @@ class ConferenceService(BaseService):
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
+        prof = LoadsProfiles.get(p_key)
+        data['organizerDisplayName'] = request.organizerDisplayName = (
+            prof.displayName if prof else user.nickname())
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        # create Conference with its seat shards, send email to organizer
+        # confirming creation of Conference & return (modified) ConferenceForm
+        conf = Conference(**data)
+        shards = ShardsSeats.create_shards(conf, data['seatsAvailable'])
+        ndb.put_multi([conf] + shards)
+        AnnouncesConferences.update(c_key, data['seatsAvailable'])
+        self.conferences_changed()
 
         taskqueue.add(
             params={'email': user.email(), 'conferenceInfo': repr(request)},
@@ -100,7 +185,8 @@ class ConferenceService(BaseService):
 
         return request
 
-    @ndb.transactional()
+    # Cross-group, as capacity changes also update the seat shards
+    @ndb.transactional(xg=True)
     def update_conference_object(self, request):
         """Update a conference with user input."""
         user = endpoints.get_current_user()
@@ -127,7 +213,12 @@ class ConferenceService(BaseService):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        max_attendees = conf.maxAttendees or 0
         for field in request.all_fields():
+            # the display name is kept in sync from the organizer's profile,
+            # and available seats from the seat shards
+            if field.name in ('organizerDisplayName', 'seatsAvailable'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -138,7 +229,57 @@ class ConferenceService(BaseService):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # seats are added or removed along with the capacity
+        delta = (conf.maxAttendees or 0) - max_attendees
+        if delta:
+            if not ShardsSeats(conf).resize(delta):
+                raise endpoints.BadRequestException(
+                    "'maxAttendees' can not be lower than the seats already "
+                    "taken.")
+            seats = conf.seatsAvailable
+            ndb.get_context().call_on_commit(
+                lambda: AnnouncesConferences.update(conf.key, seats))
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self.copy_conference_to_form(
-            ConferenceForm(), conf, prof.displayName)
+        # Only invalidate once the update is visible, so the old conference
+        # can't be cached again under the new version
+        ndb.get_context().call_on_commit(self.conferences_changed)
+        return self.copy_conference_to_form(ConferenceForm(), conf)
+
+    @staticmethod
+    def update_organizer_display_name(user_id, page_token=None):
+        """Copy an organizer's display name onto a batch of their conferences,
+        queueing up the next batch if there are more.
+
+        Args:
+            user_id (string)
+            page_token (string)
+        """
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get()
+        if not prof:
+            return
+
+        cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+        c_keys, next_cursor, more = Conference.query(
+            ancestor=p_key).fetch_page(ORGANIZER_NAME_BATCH_SIZE,
+                                       start_cursor=cursor, keys_only=True)
+
+        @ndb.transactional()
+        def update(c_key):
+            """Set the name on one conference, leaving its other fields as
+            they are now rather than as they were when the batch was read."""
+            conf = c_key.get()
+            if conf and conf.organizerDisplayName != prof.displayName:
+                conf.organizerDisplayName = prof.displayName
+                conf.put()
+                ndb.get_context().call_on_commit(
+                    ConferenceService.conferences_changed)
+
+        for c_key in c_keys:
+            update(c_key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'user_id': user_id,
+                                  'cursor': next_cursor.urlsafe()},
+                          url=UPDATE_ORGANIZER_NAME_URL)
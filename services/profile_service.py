@@ -6,11 +6,15 @@ Handle requests related to Profiles.
 """
 
 import endpoints
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
 from models.profile import Profile, TeeShirtSize, ProfileForm
+from models.registration import Registration
 from services.base_service import BaseService
+from services.conference_service import UPDATE_ORGANIZER_NAME_URL
 from support.Auth import Auth
+from support.LoadsProfiles import LoadsProfiles
 
 
 class ProfileService(BaseService):
@@ -33,8 +37,26 @@ class ProfileService(BaseService):
         if tee_shirt_size is not None:
             profile_form.teeShirtSize = getattr(TeeShirtSize, tee_shirt_size)
 
-        return super(ProfileService, self).copy_entity_to_form(
+        profile_form = super(ProfileService, self).copy_entity_to_form(
             profile_form, profile)
+        profile_form.conferenceKeysToAttend = [
+            c_key.urlsafe() for c_key in
+            self.conference_keys_to_attend(profile.key)]
+        return profile_form
+
+    @staticmethod
+    def conference_keys_to_attend(p_key):
+        """Gets the keys of the conferences a user is registered for.
+
+        Args:
+            p_key (ndb.Key): the user's Profile key
+
+        Returns:
+            list of ndb.Key
+        """
+        # Registrations are keyed by the urlsafe conference key
+        return [ndb.Key(urlsafe=reg_key.id()) for reg_key in
+                Registration.query(ancestor=p_key).fetch(keys_only=True)]
 
     def get_profile_from_user(self):
         """Return user Profile from datastore, creating new one if
@@ -47,13 +69,13 @@ class ProfileService(BaseService):
         # get Profile from datastore
         user_id = self.auth.get_user_id(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = LoadsProfiles.get(p_key)
         # create new Profile if not there
         if not profile:
             profile = Profile(key=p_key, displayName=user.nickname(),
                               mainEmail=user.email(),
                               teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED), )
-            profile.put()
+            LoadsProfiles.put(profile)
 
         return profile  # return Profile
 
@@ -63,7 +85,9 @@ class ProfileService(BaseService):
         prof = self.get_profile_from_user()
 
         # if saveProfile(), process user-modifyable fields
+        display_name = prof.displayName
         if save_request:
+            changed = False
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -73,7 +97,14 @@ class ProfileService(BaseService):
                         #    setattr(prof, field, str(val).upper())
                         # else:
                         #    setattr(prof, field, val)
-                        prof.put()
+                        changed = True
+            if changed:
+                LoadsProfiles.put(prof)
+
+            # conferences keep a copy of their organizer's name
+            if prof.displayName != display_name:
+                taskqueue.add(params={'user_id': prof.key.id()},
+                              url=UPDATE_ORGANIZER_NAME_URL)
 
         # return ProfileForm
         return self.copy_profile_to_form(ProfileForm(), prof)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""registration_service.py
+
+Handle requests related to conference Registrations.
+"""
+
+import endpoints
+from google.appengine.ext import ndb
+
+from models.conference import Conference, ConferenceForm, ConferenceForms
+from models.models import ConflictException, BooleanMessage
+from models.registration import Registration, AttendeeForms
+from services.base_service import BaseService
+from services.conference_service import ConferenceService
+from services.profile_service import ProfileService
+from support.AnnouncesConferences import AnnouncesConferences
+from support.Auth import Auth
+from support.ShardsSeats import ShardsSeats
+
+
+class RegistrationService(BaseService):
+    """Interface between the client and Registration Data Store."""
+
+    def __init__(self, auth=None):
+        self.auth = auth if auth is not None else Auth()
+        self.conference_service = ConferenceService(auth=self.auth)
+        self.profile_service = ProfileService()
+
+    @staticmethod
+    def registration_key(p_key, c_key):
+        """Gets the key of a user's registration for a conference.
+
+        Args:
+            p_key (ndb.Key): the user's Profile key
+            c_key (ndb.Key): the Conference key
+
+        Returns:
+            ndb.Key
+        """
+        return ndb.Key(Registration, c_key.urlsafe(), parent=p_key)
+
+    def conference_registration(self, websafe_conference_key, reg=True):
+        """Register or unregister user for selected conference.
+
+        Args:
+            websafe_conference_key (string)
+            reg (bool): False to unregister
+
+        Returns:
+            BooleanMessage
+
+        Raises:
+            endpoints.NotFoundException
+            ConflictException
+        """
+        # get user Profile, creating it if needed
+        p_key = self.profile_service.get_profile_from_user().key
+
+        # check if conf exists given websafeConfKey
+        # get conference; check that it exists
+        c_key = ndb.Key(urlsafe=websafe_conference_key)
+        conf = c_key.get()
+        if not conf or not isinstance(conf, Conference):
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafe_conference_key)
+
+        reg_key = self.registration_key(p_key, c_key)
+        seats = ShardsSeats(conf)
+
+        # register
+        if reg:
+            def register():
+                """Create the registration, within the seat transaction."""
+                # check if user already registered otherwise add
+                if reg_key.get() is not None:
+                    raise ConflictException(
+                        "You have already registered for this conference")
+                return [Registration(key=reg_key, conference=c_key)]
+
+            # register user, take away one seat
+            if not seats.reserve(register):
+                raise ConflictException("There are no seats available.")
+            retval = True
+
+        # unregister
+        else:
+            def unregister():
+                """Delete the registration, within the seat transaction."""
+                # check if user already registered
+                if reg_key.get() is None:
+                    return None
+                reg_key.delete()
+                return []
+
+            # unregister user, add back one seat
+            retval = seats.release(unregister)
+
+        # keep the nearly sold out announcement up to date; cached queries
+        # only change once the seat count is synced onto the conference
+        if retval:
+            AnnouncesConferences.update(c_key, seats.available())
+
+        return BooleanMessage(data=retval)
+
+    def get_conferences_to_attend(self):
+        """Gets the conferences the current user has registered for.
+
+        Returns:
+            ConferenceForms
+        """
+        p_key = self.profile_service.get_profile_from_user().key
+        conferences = ndb.get_multi(
+            self.profile_service.conference_keys_to_attend(p_key))
+
+        # return set of ConferenceForm objects per Conference
+        return ConferenceForms(items=[
+            self.conference_service.copy_conference_to_form(
+                ConferenceForm(), conf) for conf in conferences if conf])
+
+    def get_attendees(self, websafe_conference_key, page_size=None,
+                      page_token=None):
+        """Gets a page of the ids of users registered for a conference. Only
+        the conference organizer may list attendees.
+
+        Args:
+            websafe_conference_key (string)
+            page_size (int)
+            page_token (string)
+
+        Returns:
+            AttendeeForms
+
+        Raises:
+            endpoints.UnauthorizedException
+            endpoints.NotFoundException
+            endpoints.ForbiddenException
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        c_key = ndb.Key(urlsafe=websafe_conference_key)
+        conf = c_key.get()
+        if not conf or not isinstance(conf, Conference):
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafe_conference_key)
+
+        if self.auth.get_user_id(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can list the attendees of the conference.')
+
+        # registrations are keyed under the attendee's profile, so the keys
+        # alone hold the user ids
+        reg_keys, next_token = self.fetch_page(
+            Registration.query(Registration.conference == c_key),
+            page_size, page_token, keys_only=True)
+        return AttendeeForms(
+            userIds=[reg_key.parent().id() for reg_key in reg_keys],
+            nextPageToken=next_token)
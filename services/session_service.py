@@ -8,15 +8,24 @@ Handle requests related to ConferenceSessions.
 from datetime import datetime
 
 import endpoints
-from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
 from models.conference_session import ConferenceSession, ConferenceSessionForms
 from models.conference_session import ConferenceSessionForm
+from models.speaker_session_counts import SpeakerSessionCounts, \
+    SPEAKER_COUNTS_ID
 from services.base_service import BaseService
 from services.speaker_service import SpeakerService
 from support.AppliesFilters import AppliesFilters
 from support.Auth import Auth
+from support.CachesQueries import CachesQueries
+from support.FeaturesSpeakers import FeaturesSpeakers
+from support.RecommendsSessions import RecommendsSessions
+from support.ResolvesSpeakers import ResolvesSpeakers
+
+# The speaker counts are written in the same transaction as the sessions,
+# which can hold 500 entities
+MAX_SESSIONS_PER_BATCH = 499
 
 
 class SessionService(BaseService):
@@ -24,22 +33,23 @@ class SessionService(BaseService):
 
     def __init__(self, auth=None):
         self.auth = auth if auth is not None else Auth()
+        self.schedule_cache = CachesQueries('schedule')
 
-    def copy_entity_to_form(self, form, entity):
+    def copy_entity_to_form(self, form, entity, speakers=None):
         """Copies a Session entity to a SessionForm.
 
         Args:
             form (SessionForm)
             entity (Session)
+            speakers (ResolvesSpeakers): resolver shared across a result set
 
         Returns:
              SessionForm
         """
-        speaker_keys = getattr(entity, 'speakerKeys', None)
-        if speaker_keys is not None:
-            speaker_emails = [ndb.Key(urlsafe=key).get().email for key in
-                              speaker_keys]
-            form.speakerEmails = speaker_emails
+        if getattr(entity, 'speakerKeys', None) is not None:
+            if speakers is None:
+                speakers = ResolvesSpeakers()
+            form.speakerEmails = speakers.emails_for(entity)
 
         form.websafeSessionKey = entity.key.urlsafe()
 
@@ -49,6 +59,27 @@ class SessionService(BaseService):
 
         return super(SessionService, self).copy_entity_to_form(form, entity)
 
+    def copy_sessions_to_forms(self, sessions, next_page_token=None):
+        """Copies a list of Session entities to a SessionForms message,
+        resolving all of their speakers in one batch.
+
+        Args:
+            sessions (list of ConferenceSession)
+            next_page_token (string)
+
+        Returns:
+            ConferenceSessionForms
+        """
+        sessions = [session for session in sessions if session is not None]
+        speakers = ResolvesSpeakers()
+        speakers.resolve(sessions)
+
+        return ConferenceSessionForms(
+            items=[self.copy_entity_to_form(ConferenceSessionForm(), session,
+                                            speakers)
+                   for session in sessions],
+            nextPageToken=next_page_token)
+
     def create_conference_session(self, request, user):
         """Create or update Session object, returning SessionForm/request.
 
@@ -62,56 +93,152 @@ class SessionService(BaseService):
         Raises:
             endpoints.BadRequestException
         """
+        return self.create_conference_sessions(
+            request.websafeConferenceKey, [request], user)[0]
 
-        if not request.title:
-            raise endpoints.BadRequestException(
-                "Session 'title' field required")
+    def create_conference_sessions(self, websafe_conference_key, requests,
+                                   user):
+        """Create a batch of sessions in one conference. Every session is
+        validated before anything is written.
 
-        if not request.startTime:
-            raise endpoints.BadRequestException("Session 'startTime' field "
-                                                "required")
+        Args:
+            websafe_conference_key (string)
+            requests (list of ConferenceSessionForm)
+            user (User)
 
-        if not request.date:
-            raise endpoints.BadRequestException("Session 'date' field required")
+        Returns:
+            list of string
+
+        Raises:
+            endpoints.BadRequestException
+            endpoints.NotFoundException
+        """
+        if not requests:
+            raise endpoints.BadRequestException("No sessions to create")
+
+        if len(requests) > MAX_SESSIONS_PER_BATCH:
+            raise endpoints.BadRequestException(
+                "At most %d sessions can be created at once" %
+                MAX_SESSIONS_PER_BATCH)
 
-        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        date_times = [self.check_session_request(request)
+                      for request in requests]
+
+        c_key = ndb.Key(urlsafe=websafe_conference_key)
         conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafe_conference_key)
 
         # TODO: This should be in the client
         self.check_owner(conf, user)
 
-        data = {field.name: getattr(request, field.name) for field in
-                request.all_fields()}
+        emails = [email for request in requests
+                  for email in request.speakerEmails]
+        speaker_keys = SpeakerService.find_or_create_many(emails)
+
+        first_id, last_id = ConferenceSession.allocate_ids(
+            size=len(requests), parent=c_key)
+
+        sessions = []
+        for s_id, request, date_time in zip(
+                range(first_id, last_id + 1), requests, date_times):
+            data = {field.name: getattr(request, field.name) for field in
+                    request.all_fields()}
+
+            data['speakerKeys'] = []
+            for email in request.speakerEmails:
+                key = SpeakerService.speaker_key(email)
+                if key not in data['speakerKeys']:
+                    data['speakerKeys'].append(key)
+
+            del data['speakerEmails']
+            # TODO: Enable speaker entities to be updated
+
+            del data['websafeSessionKey']
+
+            data['websafeConferenceKey'] = c_key.urlsafe()
+            data['dateTime'] = date_time
+            data['hour'] = date_time.hour
+
+            del data['date']
+            del data['startTime']
+
+            data['key'] = ndb.Key(ConferenceSession, s_id, parent=c_key)
+            sessions.append(ConferenceSession(**data))
+
+        s_keys = self.put_sessions(c_key, sessions)
+        self.schedule_cache.bump(c_key.urlsafe())
+
+        if speaker_keys:
+            FeaturesSpeakers.schedule(c_key)
 
-        if request.speakerEmails:
-            data['speakerKeys'] = [SpeakerService.find_or_create(email) for
-                                   email in request.speakerEmails]
-            taskqueue.add(
-                params={'speakers': '|||'.join(data['speakerKeys']),
-                        'websafe_conference_key': request.websafeConferenceKey},
-                url='/tasks/cache_featured_speaker')
+        return [s_key.urlsafe() for s_key in s_keys]
 
-        del data['speakerEmails']
-        # TODO: Enable speaker entities to be updated
+    @staticmethod
+    @ndb.transactional()
+    def put_sessions(c_key, sessions):
+        """Write new sessions of a conference, counting them in its speaker
+        session counts.
 
-        del data['websafeSessionKey']
+        Args:
+            c_key (ndb.Key): the conference key
+            sessions (list of ConferenceSession)
+
+        Returns:
+            list of ndb.Key
+        """
+        counts_key = ndb.Key(SpeakerSessionCounts, SPEAKER_COUNTS_ID,
+                             parent=c_key)
+        counts = counts_key.get()
+        if counts is None:
+            # Conferences from before the counts existed start from a count
+            # of their existing sessions
+            counts = SpeakerSessionCounts(key=counts_key, counts={})
+            sessions_so_far = ConferenceSession.query(ancestor=c_key).fetch()
+        else:
+            counts.counts = dict(counts.counts or {})
+            sessions_so_far = []
 
-        # convert dates from strings to Date objects;
-        # set month based on start_date
-        data['dateTime'] = datetime.strptime(
-            data['date'] + ' ' + data['startTime'], "%Y-%m-%d %H:%M")
-        data['hour'] = data['dateTime'].hour
+        for session in sessions_so_far + sessions:
+            for speaker_key in session.speakerKeys:
+                speaker_id = speaker_key.id()
+                counts.counts[speaker_id] = counts.counts.get(
+                    speaker_id, 0) + 1
 
-        del data['date']
-        del data['startTime']
+        return ndb.put_multi(sessions + [counts])[:-1]
 
-        s_id = ConferenceSession.allocate_ids(size=1, parent=c_key)[0]
-        s_key = ndb.Key(ConferenceSession, s_id, parent=c_key)
-        data['key'] = s_key
+    @staticmethod
+    def check_session_request(request):
+        """Checks the required fields of a new session.
+
+        Args:
+            request (ConferenceSessionForm)
+
+        Returns:
+            datetime: the start of the session
 
-        sess = ConferenceSession(**data).put()
+        Raises:
+            endpoints.BadRequestException
+        """
+        if not request.title:
+            raise endpoints.BadRequestException(
+                "Session 'title' field required")
 
-        return sess.urlsafe()
+        if not request.startTime:
+            raise endpoints.BadRequestException("Session 'startTime' field "
+                                                "required")
+
+        if not request.date:
+            raise endpoints.BadRequestException("Session 'date' field required")
+
+        # convert dates from strings to Date objects
+        try:
+            return datetime.strptime(
+                request.date + ' ' + request.startTime, "%Y-%m-%d %H:%M")
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Session 'date' must be YYYY-MM-DD and 'startTime' HH:MM")
 
     def check_owner(self, conf, user):
         """Checks the owner of a conference.
@@ -129,85 +256,116 @@ class SessionService(BaseService):
             raise endpoints.BadRequestException("You must be the conference "
                                                 "organizer to add sessions")
 
-    def get_conference_sessions(self, websafe_conference_key):
-        """Gets all the sessions associated with a conference.
+    def get_conference_sessions(self, websafe_conference_key,
+                                page_size=None, page_token=None):
+        """Gets a page of the sessions associated with a conference. Pages are
+        cached until a session is added to the conference.
 
         Args:
             websafe_conference_key (string)
+            page_size (int)
+            page_token (string)
         Returns:
             ConferenceSessionForms
         """
-        sessions = ConferenceSession.query(
-            ConferenceSession.websafeConferenceKey ==
-            websafe_conference_key).fetch()
+        c_key = ndb.Key(urlsafe=websafe_conference_key)
+        page_size = self.page_size(page_size)
 
-        return ConferenceSessionForms(
-            items=[self.copy_entity_to_form(ConferenceSessionForm(), session)
-                   for session in sessions])
+        def get_page():
+            """Query and copy a page of the conference's sessions."""
+            sessions, next_token = self.fetch_page(
+                ConferenceSession.query(ancestor=c_key), page_size,
+                page_token)
+            return self.copy_sessions_to_forms(sessions, next_token)
 
-    def get_speaker_sessions(self, websafe_speaker_key):
-        """Gets a list of sessions featuring this speaker.
+        return self.schedule_cache.get(c_key.urlsafe(),
+                                       (page_size, page_token),
+                                       ConferenceSessionForms, get_page)
+
+    def get_speaker_sessions(self, websafe_speaker_key, page_size=None,
+                             page_token=None):
+        """Gets a page of sessions featuring this speaker.
 
         Args:
              websafe_speaker_key (string)
+             page_size (int)
+             page_token (string)
 
         Returns:
             ConferenceSessionForms
         """
-        sessions = ConferenceSession.query(
-            ConferenceSession.speakerKeys == websafe_speaker_key).fetch()
+        sessions, next_token = self.fetch_page(
+            ConferenceSession.query(
+                ConferenceSession.speakerKeys ==
+                ndb.Key(urlsafe=websafe_speaker_key)),
+            page_size, page_token)
 
-        return ConferenceSessionForms(
-            items=[self.copy_entity_to_form(ConferenceSessionForm(), session)
-                   for session in sessions])
+        return self.copy_sessions_to_forms(sessions, next_token)
+
+    def get_recommended_sessions(self, websafe_session_key):
+        """Gets the sessions most often wishlisted along with a session, from
+        the precomputed recommendations.
+
+        Args:
+             websafe_session_key (string)
+
+        Returns:
+            ConferenceSessionForms
+        """
+        session_key = ndb.Key(urlsafe=websafe_session_key)
+        sessions = ndb.get_multi(RecommendsSessions.recommend(session_key))
+        return self.copy_sessions_to_forms(sessions)
 
     def get_conference_sessions_by_type(self, websafe_conference_key,
-                                        session_type):
-        """Gets a list of sessions in a conference with a specific type.
+                                        session_type, page_size=None,
+                                        page_token=None):
+        """Gets a page of sessions in a conference with a specific type.
 
         Args:
              websafe_conference_key (string)
+             session_type (string)
+             page_size (int)
+             page_token (string)
 
         Returns:
             ConferenceSessionForms
         """
-        sessions = ConferenceSession.query(ndb.AND(
-            ConferenceSession.websafeConferenceKey == websafe_conference_key,
-            ConferenceSession.typeOfSession == session_type)).fetch()
+        sessions, next_token = self.fetch_page(
+            ConferenceSession.query(
+                ConferenceSession.typeOfSession == session_type,
+                ancestor=ndb.Key(urlsafe=websafe_conference_key)),
+            page_size, page_token)
 
-        return ConferenceSessionForms(
-            items=[self.copy_entity_to_form(ConferenceSessionForm(), session)
-                   for session in sessions])
+        return self.copy_sessions_to_forms(sessions, next_token)
 
     def get_sessions_by_type_and_filters(self, websafe_conference_key,
-                                         session_type, filters):
-        """Gets a list of sessions with a specific type and arbitrary filters.
+                                         session_type, filters,
+                                         page_size=None, page_token=None):
+        """Gets a page of sessions with a specific type and arbitrary filters.
 
         Args:
              websafe_conference_key (string)
              session_type (string)
              filters (list)
+             page_size (int)
+             page_token (string)
 
         Returns:
             ConferenceSessionForms
         """
-        if filters:
-            filter_maker = AppliesFilters(
-                ConferenceSession,
-                {'datetime': ['dateTime'],
-                 'int': ['duration', 'hour']},
-                {'TITLE': 'title',
-                 'DURATION': 'duration',
-                 'DATE': 'dateTime',
-                 'HOUR': 'hour'})
-            sessions = filter_maker.get_query(
-                filters, 'title', websafe_conference_key).fetch()
-        else:
-            sessions = ConferenceSession.query(
-                ConferenceSession.websafeConferenceKey == websafe_conference_key
-            ).fetch()
-
-        return ConferenceSessionForms(
-            items=[self.copy_entity_to_form(ConferenceSessionForm(), s)
-                   for s in sessions if
-                   s.typeOfSession == unicode(session_type)])
+        filter_maker = AppliesFilters(
+            ConferenceSession,
+            {'datetime': ['dateTime'],
+             'int': ['duration', 'hour']},
+            {'TITLE': 'title',
+             'DURATION': 'duration',
+             'DATE': 'dateTime',
+             'HOUR': 'hour'})
+        c_key = None
+        if websafe_conference_key:
+            c_key = ndb.Key(urlsafe=websafe_conference_key)
+        sessions, next_token = filter_maker.fetch_page(
+            filters or [], self.page_size(page_size), page_token, 'title',
+            c_key, {'typeOfSession': unicode(session_type)})
+
+        return self.copy_sessions_to_forms(sessions, next_token)
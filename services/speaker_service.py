@@ -5,6 +5,9 @@
 Handle requests related to Speakers.
 """
 
+import endpoints
+from google.appengine.ext import ndb
+
 from models.speaker import Speaker, SpeakerForm, SpeakerForms
 from services.base_service import BaseService
 
@@ -12,6 +15,52 @@ from services.base_service import BaseService
 class SpeakerService(BaseService):
     """Interface between the client and Speaker Data Store."""
 
+    @staticmethod
+    def speaker_key(email):
+        """Gets the key of the speaker with an email address. Speakers are
+        keyed by their normalized email, so each email maps to one speaker.
+
+        Args:
+            email (string)
+
+        Returns:
+             ndb.Key
+
+        Raises:
+            endpoints.BadRequestException
+        """
+        normalized = (email or '').strip().lower()
+        if not normalized:
+            raise endpoints.BadRequestException(
+                "Speaker email must not be empty")
+        return ndb.Key(Speaker, normalized)
+
+    @staticmethod
+    def find_or_create_many(emails):
+        """Finds existing speakers by email, creating any that do not exist,
+        with one batch read and at most one batch write.
+
+        Args:
+            emails (list of string)
+
+        Returns:
+             list of ndb.Key, in the order of the first use of each email
+        """
+        keys, addresses = [], {}
+        for email in emails:
+            key = SpeakerService.speaker_key(email)
+            if key not in addresses:
+                keys.append(key)
+                addresses[key] = email.strip()
+
+        speakers = ndb.get_multi(keys)
+        missing = [Speaker(key=key, email=addresses[key])
+                   for key, speaker in zip(keys, speakers) if speaker is None]
+        if missing:
+            ndb.put_multi(missing)
+
+        return keys
+
     @staticmethod
     def find_or_create(email):
         """Finds an existing speaker by email, or creates a new one if one does
@@ -21,23 +70,24 @@ class SpeakerService(BaseService):
             email (string)
 
         Returns:
-             Speaker
+             ndb.Key
         """
-        speaker = Speaker.query(Speaker.email == email).get()
+        return SpeakerService.find_or_create_many([email])[0]
 
-        if speaker is not None:
-            return speaker.key.urlsafe()
-        else:
-            return Speaker(email=email).put().urlsafe()
+    def get_speakers(self, page_size=None, page_token=None):
+        """Gets a page of all existing speakers.
 
-    def get_speakers(self):
-        """Gets a list of all existing speakers.
+        Args:
+            page_size (int)
+            page_token (string)
 
         Returns:
              SpeakerForms
         """
-        speakers = Speaker.query().fetch()
+        speakers, next_token = self.fetch_page(Speaker.query(), page_size,
+                                               page_token)
 
         return SpeakerForms(
             items=[self.copy_entity_to_form(
-                SpeakerForm(), speaker) for speaker in speakers])
+                SpeakerForm(), speaker) for speaker in speakers],
+            nextPageToken=next_token)
@@ -5,14 +5,15 @@
 Handle requests related to Wishlists.
 """
 
+import endpoints
 from google.appengine.ext import ndb
+from google.net.proto import ProtocolBuffer
 
-from models.conference_session import ConferenceSessionForms, \
-    ConferenceSessionForm, ConferenceSession
+from models.conference_session import ConferenceSession
 from models.models import ConflictException
 from models.profile import Profile
 from models.speaker import SpeakerForm, SpeakerForms
-from models.wishlist import Wishlist, WishlistForm
+from models.wishlist import Wishlist, WishlistForm, WISHLIST_ID
 from services.base_service import BaseService
 from services.session_service import SessionService
 from services.speaker_service import SpeakerService
@@ -24,48 +25,47 @@ class WishlistService(BaseService):
 
     def __init__(self, auth=None):
         self.speaker_service = SpeakerService()
+        self.session_service = SessionService()
         self.auth = auth if auth is not None else Auth()
 
-    def get_sessions_in_wishlist(self, user):
-        """Gets all the sessions in this user's wishlist.
+    def get_sessions_in_wishlist(self, user, page_size=None, page_token=None):
+        """Gets a page of the sessions in this user's wishlist.
 
         Args:
             user (endpoints.user)
+            page_size (int)
+            page_token (string)
 
         Returns:
              ConferenceSessionForms
         """
-        sessions = self.wishlist_sessions(user)
+        session_keys, next_token = self.slice_page(
+            self.wishlist_session_keys(user), page_size, page_token)
+        sessions = ndb.get_multi(session_keys)
+
+        return self.session_service.copy_sessions_to_forms(sessions,
+                                                           next_token)
 
-        session_service = SessionService()
-        return ConferenceSessionForms(
-            items=[
-                session_service.copy_entity_to_form(
-                    ConferenceSessionForm(), session)
-                for session in sessions])
+    def wishlist_session_keys(self, user):
+        """Helper gets the list of session keys in a user's wishlist."""
+        return self.get_wishlist(user).sessionKeys
 
     def wishlist_sessions(self, user):
         """Helper gets a list of sessions given a user."""
-        wishlist_key = self.get_wishlist_key(user)
-        session_keys = [ndb.Key(urlsafe=wsck) for wsck in
-                        wishlist_key.get().sessionKeys]
-        sessions = ndb.get_multi(session_keys)
-        return sessions
+        sessions = ndb.get_multi(self.wishlist_session_keys(user))
+        return [session for session in sessions if session is not None]
 
     def get_wishlist_key(self, user):
-        """Helper gets a wishlist key, given a user."""
+        """Helper gets a wishlist key, given a user. Every user has a single
+        wishlist, under their profile, so no lookup is needed."""
         user_id = self.auth.get_user_id(user)
-        p_key = ndb.Key(Profile, user_id)
+        return ndb.Key(Wishlist, WISHLIST_ID, parent=ndb.Key(Profile, user_id))
 
-        wishlists = Wishlist.query(ancestor=p_key).fetch()
-        if wishlists:
-            return wishlists[0].key
-
-        wl_id = Wishlist.allocate_ids(size=1, parent=p_key)[0]
-        wl_k = ndb.Key(Wishlist, wl_id, parent=p_key)
-        Wishlist(**{'key': wl_k}).put()
-
-        return wl_k
+    def get_wishlist(self, user):
+        """Helper gets a user's wishlist, which is empty if they never saved
+        a session to it."""
+        wl_key = self.get_wishlist_key(user)
+        return wl_key.get() or Wishlist(key=wl_key)
 
     def add_session_to_wishlist(self, websafe_session_key, user):
         """Adds a session to the user's wishlist.
@@ -78,17 +78,20 @@ class WishlistService(BaseService):
              WishlistForm
         """
         wl_key = self.get_wishlist_key(user)
+        session_key = ndb.Key(urlsafe=websafe_session_key)
 
-        wishlist = wl_key.get()
+        @ndb.transactional()
+        def add():
+            """Add the session, unless a concurrent request already did."""
+            wishlist = wl_key.get() or Wishlist(key=wl_key)
+            if session_key in wishlist.sessionKeys:
+                raise ConflictException(
+                    "You already have this session in your wishlist.")
+            wishlist.sessionKeys.append(session_key)
+            wishlist.put()
+            return wishlist
 
-        if websafe_session_key in wishlist.sessionKeys:
-            raise ConflictException(
-                "You already have this session in your wishlist.")
-
-        wishlist.sessionKeys.append(websafe_session_key)
-        wishlist.put()
-
-        return self.to_message(wishlist)
+        return self.to_message(add())
 
     def remove_session_from_wishlist(self, websafe_session_key, user):
         """Removes a session from the user's wishlist.
@@ -100,66 +103,117 @@ class WishlistService(BaseService):
         Returns:
              WishlistForm
         """
-        wishlist = self.get_wishlist_key(user).get()
-        if wishlist is None or wishlist.sessionKeys is []:
-            raise ConflictException("This session is not in your wishlist.")
-
-        if websafe_session_key not in wishlist.sessionKeys:
-            raise ConflictException(
-                "This session is not in your wishlist.")
+        wl_key = self.get_wishlist_key(user)
+        session_key = ndb.Key(urlsafe=websafe_session_key)
 
-        wishlist.sessionKeys.remove(websafe_session_key)
-        wishlist.put()
+        @ndb.transactional()
+        def remove():
+            """Remove the session, unless a concurrent request already did."""
+            wishlist = wl_key.get()
+            if wishlist is None or session_key not in wishlist.sessionKeys:
+                raise ConflictException(
+                    "This session is not in your wishlist.")
+            wishlist.sessionKeys.remove(session_key)
+            wishlist.put()
+            return wishlist
 
-        return self.to_message(wishlist)
+        return self.to_message(remove())
 
-    def get_sessions_by_speaker_in_wishlist(self, user):
-        """Gets a list of sessions by speakers referenced in user's wishlist.
+    def get_sessions_by_speaker_in_wishlist(self, user, page_size=None,
+                                            page_token=None):
+        """Gets a page of sessions by speakers referenced in user's wishlist.
 
         Args:
             user (endpoints.user)
+            page_size (int)
+            page_token (string)
 
         Returns:
              ConferenceSessionForms
         """
-        sessions = self.wishlist_sessions(user)
-
         speaker_keys = []
-        for s in sessions:
-            sk = getattr(s, 'speakerKeys', [])
-            speaker_keys += sk
+        for s in self.wishlist_sessions(user):
+            speaker_keys += getattr(s, 'speakerKeys', None) or []
 
-        if not speaker_keys:
-            return ConferenceSessionForms()
+        return self.sessions_matching(ConferenceSession.speakerKeys,
+                                      speaker_keys, page_size, page_token)
 
-        sessions = ConferenceSession.query(
-            ConferenceSession.speakerKeys.IN(speaker_keys)
-        ).fetch()
-
-        return ConferenceSessionForms(
-            items=[self.copy_entity_to_form(ConferenceSessionForm(), s)
-                   for s in sessions])
-
-    def get_sessions_by_types_in_wishlist(self, user):
-        """Gets a list of sessions with types referenced in user's wishlist.
+    def get_sessions_by_types_in_wishlist(self, user, page_size=None,
+                                          page_token=None):
+        """Gets a page of sessions with types referenced in user's wishlist.
 
         Args:
             user (endpoints.user)
+            page_size (int)
+            page_token (string)
 
         Returns:
              ConferenceSessionForms
         """
-        sessions = self.wishlist_sessions(user)
+        types = [getattr(s, 'typeOfSession', None)
+                 for s in self.wishlist_sessions(user)]
+
+        return self.sessions_matching(ConferenceSession.typeOfSession,
+                                      [t for t in types if t], page_size,
+                                      page_token)
 
-        types = [getattr(s, 'typeOfSession') for s in sessions]
+    def sessions_matching(self, prop, values, page_size=None,
+                          page_token=None):
+        """Helper gets a page of the sessions where a property matches any of
+        the values.
 
-        sessions = ConferenceSession.query(
-            ConferenceSession.typeOfSession.IN(types)
-        ).fetch()
+        Rather than an IN query, whose sub-queries run one after the other,
+        a keys-only query per distinct value is run concurrently. Each runs
+        in key order from after the last session of the previous page, which
+        is the page token, so a page reads at most one more key per value
+        than the page size. Only the sessions on the page are fetched.
 
-        return ConferenceSessionForms(
-            items=[self.copy_entity_to_form(ConferenceSessionForm(), s)
-                   for s in sessions])
+        Args:
+            prop (ndb.Property)
+            values (list)
+            page_size (int)
+            page_token (string): urlsafe key of the last session of the
+                previous page
+
+        Returns:
+             ConferenceSessionForms
+
+        Raises:
+            endpoints.BadRequestException
+        """
+        page_size = self.page_size(page_size)
+        try:
+            after = ndb.Key(urlsafe=page_token) if page_token else None
+        except (TypeError, ValueError,
+                ProtocolBuffer.ProtocolBufferDecodeError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+        distinct = []
+        for value in values:
+            if value not in distinct:
+                distinct.append(value)
+
+        futures = []
+        for value in distinct:
+            query = ConferenceSession.query(prop == value)
+            if after is not None:
+                query = query.filter(ConferenceSession.key > after)
+            futures.append(query.order(ConferenceSession.key).fetch_async(
+                page_size + 1, keys_only=True))
+
+        session_keys = set()
+        for future in futures:
+            session_keys.update(future.get_result())
+        session_keys = sorted(session_keys)
+
+        next_token = None
+        if len(session_keys) > page_size:
+            session_keys = session_keys[:page_size]
+            next_token = session_keys[-1].urlsafe()
+
+        sessions = ndb.get_multi(session_keys)
+        return self.session_service.copy_sessions_to_forms(sessions,
+                                                           next_token)
 
     def to_message(self, wishlist):
         """Helper takes a wishlist entity and returns a message.
@@ -171,5 +225,5 @@ class WishlistService(BaseService):
             WishlistForm
         """
         return WishlistForm(
-            sessionKeys=wishlist.sessionKeys
+            sessionKeys=self.to_websafe(wishlist.sessionKeys)
         )
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""AnnouncesConferences.py
+
+Maintains the announcement of the conferences that are nearly sold out.
+
+Registrations and unregistrations report the seats left for their conference,
+which adds or removes it from the single Announcement entity. The entity is
+only written when a conference enters or leaves the set, and the announcement
+string in memcache is rebuilt from it when it changes, or when it has been
+evicted.
+
+The announcement cron job reconciles the set with the seat shards, in case an
+update was lost.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models.announcement import Announcement
+from models.conference import Conference
+from support.CachesValues import CachesValues
+from support.ShardsSeats import ShardsSeats
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+NEARLY_SOLD_OUT = 5
+ANNOUNCEMENT_KEY = ndb.Key(Announcement, 'nearly_sold_out')
+
+
+class AnnouncesConferences(object):
+    """Keep the nearly sold out announcement in sync with seat counts."""
+
+    @staticmethod
+    def nearly_sold_out(seats):
+        """Check whether a number of seats left is worth announcing."""
+        return 0 < seats <= NEARLY_SOLD_OUT
+
+    @staticmethod
+    def update(c_key, seats):
+        """Add or remove a conference from the announcement.
+
+        Args:
+            c_key (ndb.Key): the conference key
+            seats (int): the seats left for the conference
+        """
+        announce = AnnouncesConferences.nearly_sold_out(seats)
+
+        # Most updates leave the set as it is, so check before taking the
+        # transaction
+        announcement = ANNOUNCEMENT_KEY.get()
+        if announcement and (c_key in announcement.conferenceKeys) == announce:
+            return
+
+        @ndb.transactional()
+        def write():
+            """Update the set, unless another request already did."""
+            announcement = (ANNOUNCEMENT_KEY.get() or
+                            Announcement(key=ANNOUNCEMENT_KEY))
+            keys = announcement.conferenceKeys
+            if (c_key in keys) == announce:
+                return None
+            if announce:
+                keys.append(c_key)
+            else:
+                keys.remove(c_key)
+            announcement.put()
+            return announcement
+
+        announcement = write()
+        if announcement:
+            AnnouncesConferences.cache(announcement)
+
+    @staticmethod
+    def cache(announcement):
+        """Build the announcement string and set it in memcache.
+
+        Args:
+            announcement (Announcement)
+
+        Returns:
+            string
+        """
+        text = AnnouncesConferences.text(announcement)
+        announcement_cache.set(text)
+        return text
+
+    @staticmethod
+    def text(announcement):
+        """Build the announcement string.
+
+        Args:
+            announcement (Announcement or None)
+
+        Returns:
+            string
+        """
+        keys = announcement.conferenceKeys if announcement else []
+        confs = [conf for conf in ndb.get_multi(keys) if conf]
+        if not confs:
+            return ""
+        return ANNOUNCEMENT_TPL % (', '.join(conf.name for conf in confs))
+
+    @staticmethod
+    def get():
+        """Return the announcement, rebuilding it if it was evicted.
+
+        Returns:
+            string
+        """
+        return announcement_cache.get()
+
+    @staticmethod
+    def reconcile():
+        """Rebuild the set from the seat shards.
+
+        Candidates are the conferences already announced, along with those
+        whose synced seatsAvailable is in range, so only a handful of
+        conferences have their shards read.
+
+        Returns:
+            string: the announcement
+        """
+        candidates = set(Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT,
+            Conference.seatsAvailable > 0)).fetch(keys_only=True))
+        announcement = ANNOUNCEMENT_KEY.get()
+        if announcement:
+            candidates.update(announcement.conferenceKeys)
+
+        keys = [conf.key for conf in ndb.get_multi(list(candidates))
+                if conf and AnnouncesConferences.nearly_sold_out(
+                    ShardsSeats(conf).available())]
+
+        announcement = Announcement(key=ANNOUNCEMENT_KEY,
+                                    conferenceKeys=sorted(keys))
+        announcement.put()
+        return AnnouncesConferences.cache(announcement)
+
+
+announcement_cache = CachesValues(
+    MEMCACHE_ANNOUNCEMENTS_KEY,
+    lambda: AnnouncesConferences.text(ANNOUNCEMENT_KEY.get()))
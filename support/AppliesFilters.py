@@ -4,16 +4,29 @@
 
 Enables appending generic field, operator, value filtering to an ndb query.
 
+Datastore queries only allow inequality filters on a single property. When
+filters use inequalities on several fields, the most selective one is sent to
+the datastore and the rest are applied in memory as results stream back.
+
 """
 
+import operator
 from datetime import datetime
 
 import endpoints
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
 
 OPERATORS = {'EQ': '=', 'GT': '>', 'GTEQ': '>=', 'LT': '<', 'LTEQ': '<=',
              'NE': '!='}
 
+COMPARATORS = {'=': operator.eq, '>': operator.gt, '>=': operator.ge,
+               '<': operator.lt, '<=': operator.le, '!=': operator.ne}
+
+# Upper bound on the entities read to fill one page when some filters are
+# applied in memory.
+MAX_SCANNED = 1000
+
 
 class AppliesFilters(object):
     """Register a set of filters and then apply them to an ndb query."""
@@ -23,42 +36,80 @@ class AppliesFilters(object):
         self.kind = kind
         self.int_values = field_types.get('int', [])
         self.date_values = field_types.get('date', [])
+        self.datetime_values = field_types.get('datetime', [])
         self.fields = fields
 
-    def get_query(self, filters, order_by_field='name',
-                  websafe_conference_key=None):
-        """Return formatted query from the submitted filters."""
-        if websafe_conference_key:
-            query = self.kind.query(
-                self.kind.websafeConferenceKey == websafe_conference_key)
-        else:
-            query = self.kind.query()
-
-        inequality_filter, filters = self.format_filters(filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            query = query.order(getattr(self.kind, order_by_field))
-        else:
+    def get_query(self, filters, order_by_field='name', ancestor=None,
+                  equalities=None):
+        """Return formatted query from the submitted filters, along with the
+        filters that the query could not run and must be applied in memory.
+
+        Fixed equality filters, eg. {'typeOfSession': 'workshop'}, are added
+        alongside the user's filters so the datastore only returns matches.
+        """
+        query = self.kind.query(ancestor=ancestor)
+
+        for field, value in sorted((equalities or {}).items()):
+            query = query.filter(ndb.query.FilterNode(field, '=', value))
+
+        inequality_filter, filters, memory_filters = self.plan(
+            self.format_filters(filters))
+
+        # If exists, sort on inequality filter first. Sorting on the key last
+        # keeps cursors working when "!=" splits the query in several.
+        if inequality_filter:
             query = query.order(ndb.GenericProperty(inequality_filter))
-            query = query.order(getattr(self.kind, order_by_field))
+        query = query.order(getattr(self.kind, order_by_field))
+        query = query.order(self.kind.key)
 
         for filtr in filters:
-            if filtr["field"] in self.int_values:
-                filtr["value"] = int(filtr["value"])
-            if filtr["field"] in self.date_values:
-                filtr["value"] = datetime.strptime(
-                    filtr["value"], "%Y-%m-%d").date()
             formatted_query = ndb.query.FilterNode(filtr["field"],
                                                    filtr["operator"],
                                                    filtr["value"])
             query = query.filter(formatted_query)
-        return query
+        return query, memory_filters
+
+    def fetch_page(self, filters, page_size, page_token=None,
+                   order_by_field='name', ancestor=None, equalities=None):
+        """Return a page of entities matching all of the submitted filters.
+
+        At most MAX_SCANNED entities are read for a page, so when filters are
+        applied in memory a page may hold fewer than page_size results and
+        still have a next page. The page token is the cursor after the last
+        entity read, so entities filtered out are never read twice.
+
+        Returns:
+            tuple: (list of ndb.Model, next page token or None)
+        """
+        query, memory_filters = self.get_query(filters, order_by_field,
+                                               ancestor, equalities)
+        try:
+            cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+            if not memory_filters:
+                results, next_cursor, more = query.fetch_page(
+                    page_size, start_cursor=cursor)
+                return results, (next_cursor.urlsafe()
+                                 if more and next_cursor else None)
+
+            iterator = query.iter(start_cursor=cursor, produce_cursors=True,
+                                  batch_size=min(page_size * 2, 100))
+            results, scanned, more = [], 0, False
+            for entity in iterator:
+                scanned += 1
+                if self.matches(entity, memory_filters):
+                    results.append(entity)
+                if len(results) >= page_size or scanned >= MAX_SCANNED:
+                    more = iterator.probably_has_next()
+                    break
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+        return results, iterator.cursor_after().urlsafe() if more else None
 
     def format_filters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in
@@ -71,18 +122,71 @@ class AppliesFilters(object):
                 raise endpoints.BadRequestException(
                     "Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous
-                # filters
-                # disallow the filter if inequality was performed on a
-                # different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            try:
+                if filtr["field"] in self.int_values:
+                    filtr["value"] = int(filtr["value"])
+                if filtr["field"] in self.date_values:
+                    filtr["value"] = datetime.strptime(
+                        filtr["value"], "%Y-%m-%d").date()
+                if filtr["field"] in self.datetime_values:
+                    filtr["value"] = datetime.strptime(
+                        filtr["value"], "%Y-%m-%d")
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException(
+                    "Filter contains an invalid value for %s." %
+                    filtr["field"])
 
             formatted_filters.append(filtr)
-        return inequality_field, formatted_filters
+        return formatted_filters
+
+    @staticmethod
+    def plan(filters):
+        """Pick the inequality field the datastore will filter on.
+
+        A field bounded on both sides is taken to be more selective than one
+        bounded on one side, which is more selective than "!=". Ties go to the
+        field filtered on first. Inequalities on other fields are left to be
+        applied in memory.
+
+        Returns:
+            tuple: (inequality field or None, query filters, memory filters)
+        """
+        scores = {}
+        for filtr in filters:
+            # Every operation except "=" is an inequality
+            if filtr["operator"] == "=":
+                continue
+            bounds = scores.setdefault(filtr["field"], set())
+            if filtr["operator"] in ('>', '>='):
+                bounds.add('lower')
+            elif filtr["operator"] in ('<', '<='):
+                bounds.add('upper')
+
+        inequality_field = None
+        for filtr in filters:
+            field = filtr["field"]
+            if field in scores and (
+                    inequality_field is None or
+                    len(scores[field]) > len(scores[inequality_field])):
+                inequality_field = field
+
+        query_filters, memory_filters = [], []
+        for filtr in filters:
+            if filtr["operator"] == "=" or filtr["field"] == inequality_field:
+                query_filters.append(filtr)
+            else:
+                memory_filters.append(filtr)
+        return inequality_field, query_filters, memory_filters
+
+    @staticmethod
+    def matches(entity, filters):
+        """Check an entity against filters applied in memory."""
+        for filtr in filters:
+            compare = COMPARATORS[filtr["operator"]]
+            values = getattr(entity, filtr["field"], None)
+            if not isinstance(values, list):
+                values = [values]
+            if not any(value is not None and compare(value, filtr["value"])
+                       for value in values):
+                return False
+        return True
@@ -4,21 +4,62 @@
 
 Gets a valid user id.
 
+In oauth mode, ID tokens are verified locally against Google's public keys,
+and other tokens through the tokeninfo endpoint. Either way, the user id is
+then cached in instance memory and in memcache until the token expires, so
+most calls make no request at all.
+
+In custom mode, user ids are assigned per email, kept in UserId entities and
+cached in memcache, and memoized for the rest of the request.
+
 """
 
+import hashlib
 import json
 import os
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 
-from models.conference import Conference
+from models.profile import Profile
+from models.user_id import UserId
+from support.CachesInMemory import CachesInMemory
+from support.CachesPerRequest import CachesPerRequest
+from support.VerifiesTokens import VerifiesTokens, issued_to_us
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+MEMCACHE_TOKEN_KEY = 'OAUTH_TOKEN:%s'
+MEMCACHE_USER_ID_KEY = 'USER_ID:%s'
+TOKENINFO_ATTEMPTS = 2
+
+token_user_ids = CachesInMemory('oauth_user_ids')
+
+
+def fetch_url(url):
+    """Fetch a URL with urlfetch.
+
+    Returns:
+        tuple: (status code, content, headers)
+    """
+    resp = urlfetch.fetch(url)
+    return resp.status_code, resp.content, resp.headers
 
 
 class Auth(object):
     """Get a valid user id."""
 
+    def __init__(self, fetch=None):
+        """Initialize with the function fetching URLs, which tests may stub
+
+        Args:
+            fetch (callable): takes a URL, returns (status code, content,
+                headers)
+        """
+        self.fetch = fetch if fetch is not None else fetch_url
+        self.verifier = VerifiesTokens(self.fetch)
+
     def get_user_id(self, user, id_type="email"):
         """Get a user id from an endpoints user."""
         if id_type == "email":
@@ -26,38 +67,100 @@ class Auth(object):
 
         if id_type == "oauth":
             # A workaround implementation for getting userid.
-            auth = os.getenv('HTTP_AUTHORIZATION')
-            _, token = auth.split()
-            token_type = 'id_token'
-            if 'OAUTH_USER_ID' in os.environ:
-                token_type = 'access_token'
-            url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s' %
-                   (token_type, token))
-            user = {}
-            wait = 1
-            for i in range(3):
-                resp = urlfetch.fetch(url)
-                if resp.status_code == 200:
-                    user = json.loads(resp.content)
-                    break
-                elif resp.status_code == 400 and 'invalid_token' in \
-                        resp.content:
-                    url = (
-                        'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s' %
-                        ('access_token', token)
-                    )
-                else:
-                    time.sleep(wait)
-                    wait = wait + i
-            return user.get('user_id', '')
+            _, token = os.getenv('HTTP_AUTHORIZATION').split()
+            return self.oauth_user_id(token)
 
         if id_type == "custom":
-            # implement your own user_id creation and getting algorythm
-            # this is just a sample that queries datastore for an existing
-            # profile
-            # and generates an id if profile does not exist for an email
-            profile = Conference.query(Conference.mainEmail == user.email())
-            if profile:
-                return profile.id()
-            else:
-                return str(uuid.uuid1().get_hex())
+            return self.custom_user_id(user.email())
+
+    def oauth_user_id(self, token):
+        """Get the user id an oauth token was issued to, from the cache if
+        it was seen before.
+
+        Args:
+            token (string)
+
+        Returns:
+            string: empty if the token is invalid
+        """
+        # Tokens are credentials, so only keep a hash of them
+        token_hash = hashlib.sha1(token).hexdigest()
+        cached = token_user_ids.get(token_hash)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+
+        cached = memcache.get(MEMCACHE_TOKEN_KEY % token_hash)
+        if cached is None:
+            cached = self.verifier.verify(token) or self.tokeninfo(token)
+            ttl = int(cached[1] - time.time())
+            if not cached[0] or ttl <= 0:
+                return cached[0]
+            memcache.set(MEMCACHE_TOKEN_KEY % token_hash, cached, time=ttl)
+
+        token_user_ids.set(token_hash, cached)
+        return cached[0]
+
+    def tokeninfo(self, token):
+        """Ask the tokeninfo endpoint who a token was issued to.
+
+        Args:
+            token (string)
+
+        Returns:
+            tuple: (user id, expiry timestamp); the user id is empty if the
+                token is invalid
+        """
+        token_type = 'id_token'
+        if 'OAUTH_USER_ID' in os.environ:
+            token_type = 'access_token'
+
+        # Retry straight away rather than sleeping, which would hold up the
+        # request thread
+        for _ in range(TOKENINFO_ATTEMPTS):
+            status_code, content, _ = self.fetch(TOKENINFO_URL %
+                                                 (token_type, token))
+            if status_code == 200:
+                info = json.loads(content)
+                if not isinstance(info, dict) or not issued_to_us(
+                        info.get('audience'), info.get('issued_to')):
+                    break
+                return (info.get('user_id', ''),
+                        time.time() + int(info.get('expires_in', 0)))
+            elif status_code == 400 and 'invalid_token' in content:
+                if token_type == 'access_token':
+                    break
+                token_type = 'access_token'
+        return '', 0
+
+    @staticmethod
+    def custom_user_id(email):
+        """Get the user id assigned to an email, assigning one if needed.
+
+        Args:
+            email (string)
+
+        Returns:
+            string
+        """
+        normalized = email.strip().lower()
+        memo_key = MEMCACHE_USER_ID_KEY % normalized
+        user_id = CachesPerRequest.get(memo_key)
+        if user_id is not None:
+            return user_id
+
+        # The mapping never changes, so it is cached without expiry
+        user_id = memcache.get(memo_key)
+        if user_id is None:
+            mapping = UserId.get_by_id(normalized)
+            if mapping is None:
+                # Keep the id of a profile created before the mapping existed
+                p_keys = Profile.query(Profile.mainEmail == email).fetch(
+                    1, keys_only=True)
+                new_id = p_keys[0].id() if p_keys else uuid.uuid1().get_hex()
+                mapping = UserId.get_or_insert(normalized,
+                                               userId=str(new_id))
+            user_id = mapping.userId
+            memcache.set(memo_key, user_id)
+
+        CachesPerRequest.set(memo_key, user_id)
+        return user_id
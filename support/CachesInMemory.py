@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""CachesInMemory.py
+
+Size-bounded, thread-safe LRU cache held in the memory of the instance.
+
+Entries may expire after a few seconds, which suits small, hot values that
+can be a little stale, and saves the memcache round trip on every read. Each
+instance has its own copy, so writes are not seen by other instances before
+the entries expire.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 1000
+
+
+class CachesInMemory(object):
+    """Least recently used cache, with optional expiry, shared by threads."""
+
+    # Every cache created, by name, for reporting their stats
+    caches = {}
+
+    def __init__(self, name, max_size=DEFAULT_MAX_SIZE, ttl=None):
+        """Initialize the bounds of the cache
+
+        Args:
+            name (string)
+            max_size (int): entries kept before evicting the least recent
+            ttl (float): seconds an entry is served for, None to keep it
+                until evicted
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        CachesInMemory.caches[name] = self
+
+    def get(self, key, default=None):
+        """Return a cached value, or default if missing or expired."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or (entry[1] is not None and
+                                 entry[1] <= time.time()):
+                self.counters['misses'] += 1
+                return default
+            # Re-insert to mark as most recently used
+            self.entries[key] = entry
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """Cache a value, evicting the least recently used entries when
+        full."""
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def delete(self, key):
+        """Drop a cached value."""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Drop every cached value."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Return the hit, miss and eviction counters of this instance.
+
+        Returns:
+            dict
+        """
+        with self.lock:
+            return dict(self.counters)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""CachesPerRequest.py
+
+Memoizes values for the duration of a single request.
+
+Values are kept per thread and tagged with the id App Engine gives each
+request, so a thread serving its next request starts from an empty memo,
+and concurrent requests on a threadsafe instance never see each other's
+values.
+
+"""
+
+import os
+import threading
+
+_local = threading.local()
+
+
+def _memo():
+    """Return the memo of the current request."""
+    request_id = os.environ.get('REQUEST_LOG_ID', '')
+    if getattr(_local, 'request_id', None) != request_id:
+        _local.request_id = request_id
+        _local.values = {}
+    return _local.values
+
+
+class CachesPerRequest(object):
+    """Memoize values in the current request."""
+
+    @staticmethod
+    def get(key, default=None):
+        """Return a memoized value, or default."""
+        return _memo().get(key, default)
+
+    @staticmethod
+    def set(key, value):
+        """Memoize a value until the end of the request."""
+        _memo()[key] = value
+
+    @staticmethod
+    def delete(key):
+        """Forget a memoized value, eg. after writing it."""
+        _memo().pop(key, None)
+
+    @staticmethod
+    def clear():
+        """Forget every value memoized in the current request."""
+        _memo().clear()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""CachesQueries.py
+
+Read-through memcache cache of serialized protorpc result messages.
+
+Cached results are grouped by scope, eg. a conference. Every scope has a
+version number in memcache which is part of the key of each of its entries,
+so bumping the version on write invalidates all of the cached pages for that
+scope at once, without knowing which pages were cached.
+
+Versions are also held in the memory of the instance for a moment, so a hit
+is a single memcache get. Other instances see a bump once their copy expires.
+Hit and miss counters are kept per instance, off the memcache path.
+
+"""
+
+import hashlib
+import threading
+import time
+
+from google.appengine.api import memcache
+from protorpc import protobuf
+
+from support.CachesInMemory import CachesInMemory
+
+CACHE_TIME = 60 * 60
+VERSION_TTL = 1
+
+local_versions = CachesInMemory('query_versions', ttl=VERSION_TTL)
+
+
+class CachesQueries(object):
+    """Cache query results per scope, with versioned invalidation."""
+
+    # Hit and miss counters of this instance, by namespace
+    counters = {}
+    lock = threading.Lock()
+
+    def __init__(self, namespace, cache_time=CACHE_TIME):
+        """Initialize the memcache namespace and entry lifetime"""
+        self.namespace = namespace
+        self.cache_time = cache_time
+
+    def version(self, scope):
+        """Return the current cache version of a scope."""
+        version = local_versions.get((self.namespace, scope))
+        if version is not None:
+            return version
+
+        version_key = 'version:%s' % scope
+        version = memcache.get(version_key, namespace=self.namespace)
+        if version is None:
+            # Start from the clock, so entries cached under a version that
+            # was evicted can never be reached again. Use add, so a version
+            # bumped in the meantime is not overwritten.
+            memcache.add(version_key, int(time.time() * 1000),
+                         namespace=self.namespace)
+            version = memcache.get(version_key, namespace=self.namespace)
+        local_versions.set((self.namespace, scope), version)
+        return version
+
+    def bump(self, scope):
+        """Invalidate every cached result of a scope."""
+        version_key = 'version:%s' % scope
+        version = memcache.incr(version_key, namespace=self.namespace)
+        if version is None:
+            memcache.add(version_key, int(time.time() * 1000),
+                         namespace=self.namespace)
+            version = memcache.get(version_key, namespace=self.namespace)
+        local_versions.set((self.namespace, scope), version)
+
+    def get(self, scope, params, message_type, compute):
+        """Return a cached result message, computing and caching it on a miss.
+
+        Args:
+            scope (string): the set of results a write would invalidate
+            params (tuple): everything else that identifies the result
+            message_type (messages.Message class)
+            compute (callable): returns the message on a miss
+
+        Returns:
+            messages.Message
+        """
+        key = '%s:%s:%s' % (scope, self.version(scope),
+                            hashlib.sha1(repr(params)).hexdigest())
+
+        cached = memcache.get(key, namespace=self.namespace)
+        if cached is not None:
+            self.count('hits')
+            return protobuf.decode_message(message_type, cached)
+
+        self.count('misses')
+        message = compute()
+        memcache.set(key, protobuf.encode_message(message),
+                     time=self.cache_time, namespace=self.namespace)
+        return message
+
+    def count(self, counter):
+        """Increment a hit or miss counter."""
+        with CachesQueries.lock:
+            counters = CachesQueries.counters.setdefault(
+                self.namespace, {'hits': 0, 'misses': 0})
+            counters[counter] += 1
+
+    def stats(self):
+        """Return the hit and miss counters of this instance.
+
+        Returns:
+            dict
+        """
+        with CachesQueries.lock:
+            return dict(CachesQueries.counters.get(
+                self.namespace, {'hits': 0, 'misses': 0}))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""CachesValues.py
+
+Read-through memcache cache of a single value which can be recomputed.
+
+Entries are stored along with a soft expiry time, before memcache's own
+expiry. The first request past the soft expiry refreshes the value while
+every other request keeps serving the current one. On a miss, a memcache add
+is used as a lock so a single request recomputes the value while the others
+wait briefly for it, rather than all of them recomputing it at once.
+
+Values are also kept in instance memory for a few seconds, so the hottest
+reads do not need a memcache round trip at all.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+
+from support.CachesInMemory import CachesInMemory
+
+SOFT_TTL = 5 * 60
+HARD_TTL = 60 * 60
+LOCK_TIME = 10
+WAIT_TIME = 0.05
+WAIT_ATTEMPTS = 5
+LOCAL_TTL = 5
+
+local_values = CachesInMemory('values', ttl=LOCAL_TTL)
+
+
+class CachesValues(object):
+    """Cache one value in memcache, recomputing it at most once at a time."""
+
+    def __init__(self, key, compute, soft_ttl=SOFT_TTL, hard_ttl=HARD_TTL):
+        """Initialize the memcache key and the function computing the value
+
+        Args:
+            key (string)
+            compute (callable): returns the value to cache
+            soft_ttl (int): seconds until the value is refreshed
+            hard_ttl (int): seconds until memcache drops the value, 0 to keep
+                it until evicted
+        """
+        self.key = key
+        self.lock_key = 'lock:%s' % key
+        self.compute = compute
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+
+    def get(self):
+        """Return the cached value, recomputing it if missing or stale."""
+        entry = local_values.get(self.key)
+        if entry is not None and time.time() < entry[1]:
+            return entry[0]
+
+        entry = self.entry()
+        if entry is not None:
+            value, refresh_at = entry
+            if time.time() < refresh_at:
+                local_values.set(self.key, entry)
+                return value
+            if not self.lock():
+                return value
+            return self.refresh()
+
+        for _ in range(WAIT_ATTEMPTS):
+            if self.lock():
+                return self.refresh()
+            # Another request is computing the value, give it a moment
+            time.sleep(WAIT_TIME)
+            entry = self.entry()
+            if entry is not None:
+                return entry[0]
+
+        # Whoever holds the lock is taking too long; compute without caching
+        return self.compute()
+
+    def set(self, value):
+        """Cache a value computed elsewhere, eg. by a task."""
+        entry = (value, time.time() + self.soft_ttl)
+        memcache.set(self.key, entry, time=self.hard_ttl)
+        local_values.set(self.key, entry)
+
+    def delete(self):
+        """Drop the cached value, so the next read recomputes it."""
+        memcache.delete(self.key)
+        local_values.delete(self.key)
+
+    def entry(self):
+        """Return the cached (value, refresh time) pair, or None."""
+        entry = memcache.get(self.key)
+        # Values cached before soft expiry was added are plain values
+        if not isinstance(entry, tuple) or len(entry) != 2:
+            return None
+        return entry
+
+    def lock(self):
+        """Take the lock on recomputing the value, if nobody holds it."""
+        return memcache.add(self.lock_key, 1, time=LOCK_TIME)
+
+    def refresh(self):
+        """Recompute and cache the value, then release the lock."""
+        try:
+            value = self.compute()
+            self.set(value)
+            return value
+        finally:
+            memcache.delete(self.lock_key)
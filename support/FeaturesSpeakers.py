@@ -2,46 +2,167 @@
 
 """FeaturesSpeakers.py
 
-If a new session is posted and the speaker is involved in other sessions in
-the same conference, their websafe key is cached as the featured speaker.
-
-If multiple speakers could be featured, we pick one at random.
+When sessions are posted, the speaker with the most sessions in the
+conference, if more than one, becomes its featured speaker. Sessions are
+counted per speaker as they are created, so this is a single read of the
+conference's SpeakerSessionCounts.
+
+A burst of session writes only triggers one update. The first write marks the
+conference as dirty in memcache and queues a task after a short countdown,
+named after the time window so it is never queued twice. Later writes see the
+marker and queue nothing. If queueing fails, the error is logged rather than
+failing writes that are already saved, and the marker is removed so the next
+write tries again. As the choice is deterministic, running the task more than
+once is harmless.
+
+The featured speaker is stored in the datastore, along with their name, email
+and session titles, and served from memcache in front of it.
 
 """
 
-import random
+import logging
+import time
 
 import webapp2
 from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from protorpc import protobuf
 
 from models.conference_session import ConferenceSession
+from models.featured_speaker import FeaturedSpeaker, FEATURED_SPEAKER_ID
+from models.speaker import FeaturedSpeakerForm
+from models.speaker_session_counts import SpeakerSessionCounts, \
+    SPEAKER_COUNTS_ID
+from support.CachesValues import CachesValues
+
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER:%s"
+MEMCACHE_DIRTY_KEY = "FEATURED_SPEAKER_DIRTY:%s"
+FEATURE_SPEAKER_URL = '/tasks/cache_featured_speaker'
+# Session writes within this many seconds share one featured speaker update
+COALESCE_SECONDS = 10
+
+
+def featured_speaker_key(c_key):
+    """Return the key of a conference's featured speaker."""
+    return ndb.Key(FeaturedSpeaker, FEATURED_SPEAKER_ID, parent=c_key)
+
+
+def to_form(c_key, featured):
+    """Copy a FeaturedSpeaker, if any, to a FeaturedSpeakerForm."""
+    form = FeaturedSpeakerForm(websafeConferenceKey=c_key.urlsafe())
+    if featured is not None and featured.speakerKey is not None:
+        form.websafeSpeakerKey = featured.speakerKey.urlsafe()
+        form.name = featured.name
+        form.email = featured.email
+        form.sessionTitles = featured.sessionTitles
+    return form
+
+
+def featured_speaker_cache(c_key):
+    """Return the cache of a conference's featured speaker. The form is
+    cached encoded, as read back from the datastore on a miss."""
+    def load():
+        """Read the featured speaker from the datastore."""
+        featured = featured_speaker_key(c_key).get()
+        return protobuf.encode_message(to_form(c_key, featured))
+
+    return CachesValues(MEMCACHE_FEATURED_SPEAKER_KEY % c_key.urlsafe(),
+                        load)
+
 
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+def get_featured_speaker(c_key):
+    """Return the featured speaker of a conference.
+
+    Args:
+        c_key (ndb.Key)
+
+    Returns:
+        FeaturedSpeakerForm
+    """
+    return protobuf.decode_message(FeaturedSpeakerForm,
+                                   featured_speaker_cache(c_key).get())
 
 
 class FeaturesSpeakers(webapp2.RequestHandler):
     """Handles the feature speaker task form the queue"""
 
+    @staticmethod
+    def schedule(c_key):
+        """Queue up a featured speaker update after sessions were written,
+        unless one is already pending.
+
+        Args:
+            c_key (ndb.Key): the conference key
+        """
+        websafe_conference_key = c_key.urlsafe()
+        dirty_key = MEMCACHE_DIRTY_KEY % websafe_conference_key
+        if not memcache.add(dirty_key, 1, time=COALESCE_SECONDS * 6):
+            return
+
+        window = int(time.time()) // COALESCE_SECONDS
+        try:
+            taskqueue.add(
+                name='featured-speaker-%s-%d' % (websafe_conference_key,
+                                                 window),
+                params={'websafe_conference_key': websafe_conference_key},
+                countdown=COALESCE_SECONDS, url=FEATURE_SPEAKER_URL)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+        except Exception:
+            # The sessions are already saved, so don't fail the request.
+            # Nothing was queued, so the next write has to try again.
+            logging.exception('Could not queue the featured speaker update '
+                              'for conference %s', websafe_conference_key)
+            memcache.delete(dirty_key)
+
     def post(self):
         """Checks for featured speakers, and caches one if found."""
-        keys = self.request.get('speakers').split('|||')
+        websafe_conference_key = self.request.get('websafe_conference_key')
+        c_key = ndb.Key(urlsafe=websafe_conference_key)
 
-        c_key = ndb.Key(urlsafe=self.request.get('websafe_conference_key'))
+        # Writes from now on need another update
+        memcache.delete(MEMCACHE_DIRTY_KEY % websafe_conference_key)
 
-        featured_speakers = []
-
-        # Check for multiple keys in speakerKeys
-        for key in keys:
-            sessions = ConferenceSession.query(
-                ConferenceSession.speakerKeys == key, ancestor=c_key).fetch()
+        counts = ndb.Key(SpeakerSessionCounts, SPEAKER_COUNTS_ID,
+                         parent=c_key).get()
+        if counts is None or not counts.counts:
+            return
 
-            if len(sessions) > 1:
-                featured_speakers.append(key)
+        # Most sessions first, then by speaker id, so reruns agree
+        speaker_id, count = min(counts.counts.items(),
+                                key=lambda item: (-item[1], item[0]))
+        if count < 2:
+            return
 
-        if not featured_speakers:
+        speaker_key = ndb.Key('Speaker', speaker_id)
+        featured = featured_speaker_key(c_key).get()
+        if featured is not None and featured.speakerKey == speaker_key and \
+                len(featured.sessionTitles) == count:
             return
 
-        featured_key = random.choice(featured_speakers)
+        self.feature(c_key, speaker_key)
 
-        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featured_key)
+    @staticmethod
+    def feature(c_key, speaker_key):
+        """Store and cache a conference's featured speaker.
+
+        Args:
+            c_key (ndb.Key): the conference key
+            speaker_key (ndb.Key)
+        """
+        speaker = speaker_key.get()
+        if speaker is None:
+            return
+        sessions = ConferenceSession.query(
+            ConferenceSession.speakerKeys == speaker_key,
+            ancestor=c_key).fetch()
+
+        featured = FeaturedSpeaker(
+            key=featured_speaker_key(c_key), speakerKey=speaker_key,
+            name=speaker.name, email=speaker.email,
+            sessionTitles=sorted(session.title for session in sessions))
+        featured.put()
+        featured_speaker_cache(c_key).set(
+            protobuf.encode_message(to_form(c_key, featured)))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""LoadsProfiles.py
+
+Reads Profiles at most once per request.
+
+Every service reads the current user's profile through here, so the first
+read is memoized for the rest of the request. Writes go through here too, and
+replace the memoized copy, so a stale profile is never served after a write.
+
+"""
+
+from support.CachesPerRequest import CachesPerRequest
+
+MEMO_KEY = 'profile:%s'
+# Memoized in place of a missing profile, as None means "not memoized"
+_MISSING = object()
+
+
+class LoadsProfiles(object):
+    """Request-scoped Profile reads and writes."""
+
+    @staticmethod
+    def get(p_key):
+        """Return a profile, reading it only if not read in this request.
+
+        Args:
+            p_key (ndb.Key)
+
+        Returns:
+            Profile or None
+        """
+        memo_key = MEMO_KEY % p_key.id()
+        profile = CachesPerRequest.get(memo_key)
+        if profile is None:
+            profile = p_key.get()
+            CachesPerRequest.set(memo_key,
+                                 profile if profile is not None else _MISSING)
+        return profile if profile is not _MISSING else None
+
+    @staticmethod
+    def put(profile):
+        """Write a profile, replacing its memoized copy.
+
+        Args:
+            profile (Profile)
+
+        Returns:
+            ndb.Key
+        """
+        p_key = profile.put()
+        CachesPerRequest.set(MEMO_KEY % p_key.id(), profile)
+        return p_key
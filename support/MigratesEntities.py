@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""MigratesEntities.py
+
+Backfills stored entities after a model change, one chunk per task.
+
+Each step walks a single kind with a query cursor. When a chunk is done the
+handler re-enqueues itself with the next cursor, and moves on to the next step
+once the kind is exhausted, so no single request runs into the deadline.
+
+Start the backfill by visiting /tasks/migrate_entities as an admin.
+
+"""
+
+import logging
+
+import webapp2
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models.conference import Conference
+from models.conference_session import ConferenceSession
+from models.profile import Profile
+from models.registration import Registration
+from models.speaker import Speaker
+from models.wishlist import Wishlist, WISHLIST_ID
+from services.speaker_service import SpeakerService
+
+MIGRATE_ENTITIES_URL = '/tasks/migrate_entities'
+BATCH_SIZE = 100
+
+
+def pop_legacy_values(entity, name):
+    """Remove a property that is no longer declared on the model, returning
+    its stored values.
+
+    Args:
+        entity (ndb.Model)
+        name (string): the datastore name of the legacy property
+
+    Returns:
+        list
+    """
+    if name in type(entity)._properties or name not in entity._properties:
+        return []
+    values = entity._properties[name]._get_value(entity)
+    del entity._properties[name]
+    entity._values.pop(name, None)
+    if values is None:
+        return []
+    return values if isinstance(values, list) else [values]
+
+
+def urlsafe_to_keys(legacy_name, key_property):
+    """Build a step converting repeated urlsafe strings to a KeyProperty."""
+
+    def migrate(entity):
+        websafe_keys = pop_legacy_values(entity, legacy_name)
+        if not websafe_keys:
+            return False
+        keys = getattr(entity, key_property)
+        for websafe_key in websafe_keys:
+            key = ndb.Key(urlsafe=websafe_key)
+            if key not in keys:
+                keys.append(key)
+        return True
+
+    return migrate
+
+
+def rekey_speaker(speaker):
+    """Copy a speaker onto the key of its normalized email. The old entity is
+    kept until no session points at it any more, see delete_old_speaker."""
+    new_key = SpeakerService.speaker_key(speaker.email)
+    if speaker.key != new_key and new_key.get() is None:
+        Speaker(key=new_key, email=speaker.email, name=speaker.name).put()
+    return False
+
+
+def rekey_session_speakers(session):
+    """Point a session at the email keyed copies of its speakers."""
+    keys = []
+    for key, speaker in zip(session.speakerKeys,
+                            ndb.get_multi(session.speakerKeys)):
+        if speaker is not None:
+            key = SpeakerService.speaker_key(speaker.email)
+        # A session may have listed both the old and the new speaker
+        if key not in keys:
+            keys.append(key)
+    if keys == session.speakerKeys:
+        return False
+    session.speakerKeys = keys
+    return True
+
+
+def delete_old_speaker(speaker):
+    """Delete a speaker that was copied onto its email key, once no session
+    refers to it. The query may still list sessions that were rekeyed, so
+    they are read back to check. Writes are done here, as the entity is
+    deleted rather than updated."""
+    if speaker.key == SpeakerService.speaker_key(speaker.email):
+        return False
+
+    session_keys = ConferenceSession.query(
+        ConferenceSession.speakerKeys == speaker.key).fetch(keys_only=True)
+    sessions = [session for session in ndb.get_multi(session_keys)
+                if session is not None and
+                speaker.key in session.speakerKeys]
+    if sessions:
+        logging.warning('Speaker %s is still used by %d sessions',
+                        speaker.key.urlsafe(), len(sessions))
+    else:
+        speaker.key.delete()
+    return False
+
+
+def copy_organizer_name(conf):
+    """Copy the organizer's display name onto a conference."""
+    if conf.organizerDisplayName is not None:
+        return False
+    prof = conf.key.parent().get()
+    conf.organizerDisplayName = prof.displayName if prof else ''
+    return True
+
+
+def create_registrations(prof):
+    """Move the conferences listed on a profile to Registration entities.
+    The seats for them were already taken when the user registered."""
+    if not prof.conferenceKeysToAttend:
+        return False
+    ndb.put_multi([
+        Registration(id=c_key.urlsafe(), parent=prof.key, conference=c_key)
+        for c_key in prof.conferenceKeysToAttend])
+    prof.conferenceKeysToAttend = []
+    return True
+
+
+def rekey_wishlist(wishlist):
+    """Merge a wishlist with an allocated id into the user's wishlist with
+    the fixed id. Writes are done here, as the old entity is deleted."""
+    new_key = ndb.Key(Wishlist, WISHLIST_ID, parent=wishlist.key.parent())
+    if wishlist.key == new_key:
+        return False
+
+    @ndb.transactional()
+    def merge():
+        """Merge, in the profile's entity group, with live updates."""
+        old = wishlist.key.get()
+        if old is None:
+            return
+        new = new_key.get() or Wishlist(key=new_key)
+        for key in old.sessionKeys:
+            if key not in new.sessionKeys:
+                new.sessionKeys.append(key)
+        new.put()
+        old.key.delete()
+
+    merge()
+    return False
+
+
+# Steps run in order: (name, kind, migrate function). A migrate function
+# updates one entity in place and returns True if it needs to be written.
+STEPS = [
+    ('session_speaker_keys', ConferenceSession,
+     urlsafe_to_keys('speakerKeys', 'speakerKeys')),
+    ('speaker_email_keys', Speaker, rekey_speaker),
+    ('session_speaker_email_keys', ConferenceSession,
+     rekey_session_speakers),
+    ('speaker_old_keys', Speaker, delete_old_speaker),
+    ('wishlist_session_keys', Wishlist,
+     urlsafe_to_keys('sessionKeys', 'sessionKeys')),
+    ('profile_conference_keys', Profile,
+     urlsafe_to_keys('conferenceKeysToAttend', 'conferenceKeysToAttend')),
+    ('conference_organizer_names', Conference, copy_organizer_name),
+    ('profile_registrations', Profile, create_registrations),
+    ('wishlist_ids', Wishlist, rekey_wishlist),
+]
+
+
+def enqueue_step(step, cursor=None):
+    """Queue up a chunk of a migration step."""
+    params = {'step': step}
+    if cursor:
+        params['cursor'] = cursor
+    taskqueue.add(params=params, url=MIGRATE_ENTITIES_URL)
+
+
+class MigratesEntities(webapp2.RequestHandler):
+    """Handles the entity backfill tasks from the queue."""
+
+    def get(self):
+        """Starts the backfill from the first step."""
+        enqueue_step(STEPS[0][0])
+        self.response.set_status(202)
+
+    def post(self):
+        """Migrates one chunk of entities, then queues the next one."""
+        names = [name for name, _, _ in STEPS]
+        step = self.request.get('step')
+        if step not in names:
+            logging.error('Unknown migration step: %s', step)
+            return
+
+        index = names.index(step)
+        _, kind, migrate = STEPS[index]
+
+        cursor = self.request.get('cursor')
+        cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        entities, next_cursor, more = kind.query().fetch_page(
+            BATCH_SIZE, start_cursor=cursor)
+
+        changed = [entity for entity in entities if migrate(entity)]
+        ndb.put_multi(changed)
+        logging.info('Migration %s: updated %d of %d entities', step,
+                     len(changed), len(entities))
+
+        if more and next_cursor:
+            enqueue_step(step, next_cursor.urlsafe())
+        elif index + 1 < len(STEPS):
+            enqueue_step(STEPS[index + 1][0])
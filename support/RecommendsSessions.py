@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+"""RecommendsSessions.py
+
+Precomputes "also wishlisted" session recommendations.
+
+A cron job reads every wishlist once, a batch per task, chaining the tasks
+with a query cursor so no single request runs into the deadline. For each
+conference, the wishlists of a batch are turned into a wishlist by session
+incidence matrix W, and W.T * W counts how often each pair of sessions was
+wishlisted together. The counts are added up across the batches in a
+SessionCoOccurrence entity per conference.
+
+Once every wishlist is counted, the TOP_K sessions most often wishlisted with
+each session are stored in a SessionRecommendations entity for the
+conference, which is all getRecommendedSessions has to read. A last chain of
+tasks deletes the recommendations that the run did not write, for
+conferences that no longer have any wishlisted sessions.
+
+"""
+
+import logging
+from datetime import datetime
+
+import numpy
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models.conference_session import ConferenceSession
+from models.session_co_occurrence import SessionCoOccurrence
+from models.session_recommendations import SessionRecommendations
+from models.wishlist import Wishlist
+
+BUILD_RECOMMENDATIONS_URL = '/crons/build_recommendations'
+TOP_K = 10
+# Wishlists counted per task, and multiplied per matrix chunk
+BATCH_SIZE = 500
+# Conferences ranked, or recommendations swept, per task
+CONFERENCE_BATCH_SIZE = 20
+# Format of the run start passed along the task chain
+STARTED_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def enqueue_step(step, started, cursor=None):
+    """Queue up a chunk of a recommendations run."""
+    params = {'step': step, 'started': started}
+    if cursor:
+        params['cursor'] = cursor
+    taskqueue.add(params=params, url=BUILD_RECOMMENDATIONS_URL)
+
+
+class RecommendsSessions(object):
+    """Build and read the session recommendations of each conference."""
+
+    @staticmethod
+    def start():
+        """Start rebuilding the recommendations of every conference."""
+        RecommendsSessions.count(datetime.utcnow().strftime(STARTED_FORMAT))
+
+    @staticmethod
+    def run(step, started, page_token=None):
+        """Run a chunk of a recommendations run, from the task queue.
+
+        Args:
+            step (string): 'count', 'rank' or 'sweep'
+            started (string): when the run started, in STARTED_FORMAT
+            page_token (string)
+        """
+        steps = {'count': RecommendsSessions.count,
+                 'rank': RecommendsSessions.rank,
+                 'sweep': RecommendsSessions.sweep}
+        if step not in steps:
+            logging.error('Unknown recommendations step: %s', step)
+            return
+        steps[step](started, page_token)
+
+    @staticmethod
+    def count(started, page_token=None):
+        """Add the session pairs of a batch of wishlists to the counts of
+        their conferences, queueing up the next batch, or the ranking once
+        there are no more.
+
+        Args:
+            started (string): when the run started, in STARTED_FORMAT
+            page_token (string)
+        """
+        cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+        wishlists, next_cursor, more = Wishlist.query().fetch_page(
+            BATCH_SIZE, start_cursor=cursor)
+
+        # conference key -> ({session id: column}, [(wishlist row, column)])
+        conferences = {}
+        for row, wishlist in enumerate(wishlists):
+            for session_key in wishlist.sessionKeys:
+                c_key = session_key.parent()
+                if c_key is None or session_key.integer_id() is None:
+                    continue
+                columns, cells = conferences.setdefault(c_key, ({}, []))
+                column = columns.setdefault(session_key.id(), len(columns))
+                cells.append((row, column))
+
+        c_keys = list(conferences)
+        stored = ndb.get_multi([ndb.Key(SessionCoOccurrence, c_key.urlsafe())
+                                for c_key in c_keys])
+        counted = []
+        for c_key, co_occurrence in zip(c_keys, stored):
+            columns, cells = conferences[c_key]
+            counts = RecommendsSessions.co_occurrence(
+                numpy.array(cells, dtype=numpy.int32), len(columns))
+            counted.append(RecommendsSessions.add_counts(
+                co_occurrence, c_key, started,
+                sorted(columns, key=columns.get), counts))
+        ndb.put_multi(counted)
+        logging.info('Counted %d wishlists for %d conferences',
+                     len(wishlists), len(counted))
+
+        if more and next_cursor:
+            enqueue_step('count', started, next_cursor.urlsafe())
+        else:
+            enqueue_step('rank', started)
+
+    @staticmethod
+    def add_counts(co_occurrence, c_key, started, session_ids, counts):
+        """Add the pair counts of a batch to those of a conference so far.
+
+        Args:
+            co_occurrence (SessionCoOccurrence): the counts so far, or None
+            c_key (ndb.Key)
+            started (string): when the run started, in STARTED_FORMAT
+            session_ids (list of int): the sessions of the rows of counts
+            counts (numpy.ndarray): the pair counts of the batch
+
+        Returns:
+            SessionCoOccurrence
+        """
+        stored_ids, stored_counts = [], None
+        if co_occurrence is not None and co_occurrence.started == started:
+            stored_ids = numpy.fromstring(co_occurrence.sessionIds,
+                                          dtype=numpy.int64).tolist()
+            stored_counts = numpy.fromstring(
+                co_occurrence.counts, dtype=numpy.int32).reshape(
+                    len(stored_ids), len(stored_ids))
+
+        # Sessions new to this batch are added after those seen so far
+        index = {session_id: column
+                 for column, session_id in enumerate(stored_ids)}
+        for session_id in session_ids:
+            index.setdefault(session_id, len(index))
+        merged = numpy.zeros((len(index), len(index)), dtype=numpy.int32)
+        if stored_counts is not None:
+            merged[:len(stored_ids), :len(stored_ids)] = stored_counts
+        columns = numpy.array([index[session_id]
+                               for session_id in session_ids])
+        merged[numpy.ix_(columns, columns)] += counts
+
+        return SessionCoOccurrence(
+            id=c_key.urlsafe(), started=started,
+            sessionIds=numpy.array(sorted(index, key=index.get),
+                                   dtype=numpy.int64).tostring(),
+            counts=merged.tostring())
+
+    @staticmethod
+    def rank(started, page_token=None):
+        """Turn the counts of a batch of conferences into recommendations,
+        queueing up the next batch, or the sweep once there are no more.
+
+        Args:
+            started (string): when the run started, in STARTED_FORMAT
+            page_token (string)
+        """
+        cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+        counted, next_cursor, more = SessionCoOccurrence.query().fetch_page(
+            CONFERENCE_BATCH_SIZE, start_cursor=cursor)
+
+        recommendations, done = [], []
+        for co_occurrence in counted:
+            # Leave the counts of a later run alone; drop those of an
+            # earlier one that never finished
+            if co_occurrence.started > started:
+                continue
+            done.append(co_occurrence.key)
+            if co_occurrence.started < started:
+                continue
+
+            session_ids = numpy.fromstring(co_occurrence.sessionIds,
+                                           dtype=numpy.int64)
+            counts = numpy.fromstring(
+                co_occurrence.counts, dtype=numpy.int32).reshape(
+                    len(session_ids), len(session_ids))
+            recommendations.append(SessionRecommendations(
+                id=co_occurrence.key.id(),
+                sessionIds=session_ids.tostring(),
+                neighbours=RecommendsSessions.top_neighbours(
+                    counts).tostring(),
+                topK=TOP_K))
+
+        ndb.put_multi(recommendations)
+        ndb.delete_multi(done)
+        logging.info('Built session recommendations for %d conferences',
+                     len(recommendations))
+
+        if more and next_cursor:
+            enqueue_step('rank', started, next_cursor.urlsafe())
+        else:
+            enqueue_step('sweep', started)
+
+    @staticmethod
+    def sweep(started, page_token=None):
+        """Delete a batch of the recommendations written before the run
+        started, queueing up the next batch if there are more.
+
+        Args:
+            started (string): when the run started, in STARTED_FORMAT
+            page_token (string)
+        """
+        cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+        recommendations, next_cursor, more = (
+            SessionRecommendations.query().fetch_page(
+                CONFERENCE_BATCH_SIZE, start_cursor=cursor))
+
+        run_start = datetime.strptime(started, STARTED_FORMAT)
+        stale = [recommendation.key for recommendation in recommendations
+                 if not recommendation.created or
+                 recommendation.created < run_start]
+        ndb.delete_multi(stale)
+        if stale:
+            logging.info('Deleted %d stale session recommendations',
+                         len(stale))
+
+        if more and next_cursor:
+            enqueue_step('sweep', started, next_cursor.urlsafe())
+
+    @staticmethod
+    def co_occurrence(cells, sessions):
+        """Count how often each pair of sessions was wishlisted together.
+
+        Args:
+            cells (numpy.ndarray): (wishlist row, session column) pairs
+            sessions (int): the number of session columns
+
+        Returns:
+            numpy.ndarray: sessions x sessions counts, 0 on the diagonal
+        """
+        # Number the wishlists of this conference from 0, in order
+        wishlists, rows = numpy.unique(cells[:, 0], return_inverse=True)
+        columns = cells[:, 1]
+        order = numpy.argsort(rows, kind='mergesort')
+        rows, columns = rows[order], columns[order]
+
+        # Only BATCH_SIZE rows of the incidence matrix exist at a time
+        co_occurrence = numpy.zeros((sessions, sessions), dtype=numpy.int32)
+        starts = numpy.arange(0, len(wishlists) + BATCH_SIZE, BATCH_SIZE)
+        bounds = numpy.searchsorted(rows, starts)
+        for start, first, last in zip(starts, bounds[:-1], bounds[1:]):
+            incidence = numpy.zeros((BATCH_SIZE, sessions), dtype=numpy.int32)
+            incidence[rows[first:last] - start, columns[first:last]] = 1
+            co_occurrence += incidence.T.dot(incidence)
+        numpy.fill_diagonal(co_occurrence, 0)
+        return co_occurrence
+
+    @staticmethod
+    def top_neighbours(co_occurrence):
+        """Find the sessions most often wishlisted with each session.
+
+        Args:
+            co_occurrence (numpy.ndarray): sessions x sessions pair counts
+
+        Returns:
+            numpy.ndarray: sessions x TOP_K session columns, padded with -1
+        """
+        sessions = len(co_occurrence)
+
+        # Sort by count, most first, keeping the lowest column on ties
+        order = numpy.argsort(-co_occurrence, axis=1, kind='mergesort')
+        neighbours = order[:, :TOP_K].astype(numpy.int32)
+        counts = co_occurrence[numpy.arange(sessions)[:, None], neighbours]
+        neighbours[counts == 0] = -1
+
+        # Pad, for conferences with fewer than TOP_K + 1 sessions
+        padded = numpy.empty((sessions, TOP_K), dtype=numpy.int32)
+        padded.fill(-1)
+        padded[:, :neighbours.shape[1]] = neighbours
+        return padded
+
+    @staticmethod
+    def recommend(session_key):
+        """Return the keys of the sessions most often wishlisted with a
+        session.
+
+        Args:
+            session_key (ndb.Key)
+
+        Returns:
+            list of ndb.Key
+        """
+        c_key = session_key.parent()
+        if c_key is None:
+            return []
+        recommendations = SessionRecommendations.get_by_id(c_key.urlsafe())
+        if recommendations is None:
+            return []
+
+        session_ids = numpy.fromstring(recommendations.sessionIds,
+                                       dtype=numpy.int64)
+        rows = numpy.nonzero(session_ids == session_key.id())[0]
+        if not len(rows):
+            return []
+
+        neighbours = numpy.fromstring(
+            recommendations.neighbours, dtype=numpy.int32).reshape(
+                len(session_ids), recommendations.topK)[rows[0]]
+        return [ndb.Key(ConferenceSession, int(session_ids[column]),
+                        parent=c_key)
+                for column in neighbours if column >= 0]
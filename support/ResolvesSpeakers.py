@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""ResolvesSpeakers.py
+
+Resolves the speaker emails for a set of sessions with a single batched
+datastore read, rather than one get per speaker per session.
+
+A speaker's email never changes, so resolved emails are also kept in a small,
+bounded, per-instance cache shared across requests. The speaker migration
+re-keys speakers by email, but it copies each speaker onto its new key and
+only deletes the old one once no session refers to it. A cached entry for an
+old key still holds the right email, and it is no longer looked up once the
+sessions point at the new key.
+
+"""
+
+from google.appengine.ext import ndb
+
+from support.CachesInMemory import CachesInMemory
+
+MAX_CACHED_SPEAKERS = 1000
+
+speaker_emails = CachesInMemory('speaker_emails', MAX_CACHED_SPEAKERS)
+
+
+class ResolvesSpeakers(object):
+    """Request-scoped speaker key to email resolver."""
+
+    def __init__(self):
+        self.emails = {}
+
+    def resolve(self, sessions):
+        """Load the emails of every speaker referenced by the sessions.
+
+        Args:
+            sessions (list of ConferenceSession)
+        """
+        missing = set()
+        for session in sessions:
+            if session is None:
+                continue
+            for key in getattr(session, 'speakerKeys', None) or []:
+                if key in self.emails:
+                    continue
+                email = speaker_emails.get(key)
+                if email is not None:
+                    self.emails[key] = email
+                else:
+                    missing.add(key)
+
+        if not missing:
+            return
+
+        missing = list(missing)
+        speakers = ndb.get_multi(missing)
+        for key, speaker in zip(missing, speakers):
+            if speaker is None:
+                continue
+            self.emails[key] = speaker.email
+            speaker_emails.set(key, speaker.email)
+
+    def emails_for(self, session):
+        """Return the speaker emails of a single, already resolved, session.
+
+        Args:
+            session (ConferenceSession)
+
+        Returns:
+            list of string
+        """
+        keys = getattr(session, 'speakerKeys', None) or []
+        unresolved = [key for key in keys if key not in self.emails]
+        if unresolved:
+            self.resolve([session])
+        return [self.emails[key] for key in keys if key in self.emails]
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""ShardsSeats.py
+
+Keeps the seats available for a conference in several SeatShard entities.
+
+A registration takes a seat from one shard, picked at random among those with
+seats left, in the same transaction as the registration itself. A shard is
+only ever decremented while it has seats, so the conference can never be
+oversold, and concurrent registrations only contend when they pick the same
+shard.
+
+Conference.seatsAvailable is a copy of the shard total, which is brought back
+in sync by the reconciliation cron job rather than on every registration.
+Registrations mark the shards they change as dirty, so the job only reads the
+conferences that had registrations since it last ran. A separate, rare audit
+job compares every conference with its registrations.
+
+"""
+
+import logging
+import random
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models.conference import Conference
+from models.registration import Registration
+from models.seat_shard import SeatShard
+
+SHARD_COUNT = 20
+RECONCILE_SEATS_URL = '/crons/reconcile_seats'
+AUDIT_SEATS_URL = '/crons/audit_seats'
+RECONCILE_BATCH_SIZE = 50
+
+
+class ShardsSeats(object):
+    """Reserve and release the seats of one conference."""
+
+    def __init__(self, conf):
+        """Initialize with the conference whose seats are sharded"""
+        self.conf = conf
+
+    @staticmethod
+    def shard_keys(conf):
+        """Return the keys of every seat shard of a conference."""
+        return [ndb.Key(SeatShard, '%s:%d' % (conf.key.urlsafe(), index))
+                for index in range(conf.seatShards)]
+
+    @staticmethod
+    def create_shards(conf, seats):
+        """Split seats over new shards, recording the count on conf.
+
+        Args:
+            conf (Conference): must already have its key
+            seats (int)
+
+        Returns:
+            list of SeatShard, to be written along with conf
+        """
+        seats = max(seats or 0, 0)
+        conf.seatShards = max(1, min(SHARD_COUNT, seats))
+        share, extra = divmod(seats, conf.seatShards)
+        return [SeatShard(key=key, seats=share + (1 if index < extra else 0))
+                for index, key in enumerate(ShardsSeats.shard_keys(conf))]
+
+    def ensure_sharded(self):
+        """Move the seats of a conference created before seat shards existed
+        onto shards."""
+        if self.conf.seatShards:
+            return
+
+        @ndb.transactional(xg=True)
+        def shard():
+            """Create the shards unless another request already did."""
+            conf = self.conf.key.get()
+            if not conf.seatShards:
+                shards = self.create_shards(conf, conf.seatsAvailable)
+                ndb.put_multi([conf] + shards)
+            return conf
+
+        self.conf = shard()
+
+    def available(self):
+        """Return the seats left across every shard."""
+        self.ensure_sharded()
+        shards = ndb.get_multi(self.shard_keys(self.conf))
+        return sum(shard.seats for shard in shards if shard)
+
+    def reserve(self, register):
+        """Take a seat, in the same transaction as a registration.
+
+        Args:
+            register (callable): run inside the transaction; returns the
+                entities to write with the shard, or raises to abort
+
+        Returns:
+            bool: False if no seats are left
+        """
+        self.ensure_sharded()
+        shards = [shard for shard in
+                  ndb.get_multi(self.shard_keys(self.conf))
+                  if shard and shard.seats > 0]
+        random.shuffle(shards)
+
+        @ndb.transactional(xg=True)
+        def take(shard_key):
+            """Take a seat from a shard, if it still has one."""
+            shard = shard_key.get()
+            if shard is None or shard.seats <= 0:
+                return False
+            shard.seats -= 1
+            shard.dirty = True
+            ndb.put_multi([shard] + register())
+            return True
+
+        # The shard totals were read outside of the transaction, so a shard
+        # may have sold out since; move on to the next one if so.
+        for shard in shards:
+            if take(shard.key):
+                return True
+        return False
+
+    def release(self, unregister):
+        """Give a seat back, in the same transaction as an unregistration.
+
+        Args:
+            unregister (callable): run inside the transaction; returns the
+                entities to write with the shard, or None if there is no
+                registration to cancel
+
+        Returns:
+            bool: False if there was nothing to release
+        """
+        self.ensure_sharded()
+        shard_key = random.choice(self.shard_keys(self.conf))
+
+        @ndb.transactional(xg=True)
+        def give():
+            """Add a seat back to a shard."""
+            entities = unregister()
+            if entities is None:
+                return False
+            shard = shard_key.get() or SeatShard(key=shard_key)
+            shard.seats += 1
+            shard.dirty = True
+            ndb.put_multi([shard] + entities)
+            return True
+
+        return give()
+
+    def resize(self, delta):
+        """Add or remove seats when the capacity of the conference changes.
+
+        This must run in the caller's cross-group transaction, which then
+        writes the conference. Seats are taken from the fullest shards first.
+
+        Args:
+            delta (int): seats to add, or remove if negative
+
+        Returns:
+            bool: False if fewer than -delta seats are left, ie. the seats
+                would go below those already taken
+        """
+        conf = self.conf
+        if not conf.seatShards:
+            # Not sharded yet; the shards will start from seatsAvailable
+            seats = (conf.seatsAvailable or 0) + delta
+            if seats < 0:
+                return False
+            conf.seatsAvailable = seats
+            return True
+
+        keys = self.shard_keys(conf)
+        shards = [shard or SeatShard(key=key)
+                  for key, shard in zip(keys, ndb.get_multi(keys))]
+        available = sum(shard.seats for shard in shards)
+        if available + delta < 0:
+            return False
+
+        if delta > 0:
+            shards[0].seats += delta
+            changed = [shards[0]]
+        else:
+            changed, remove = [], -delta
+            for shard in sorted(shards, key=lambda s: -s.seats):
+                if not remove:
+                    break
+                taken = min(shard.seats, remove)
+                shard.seats -= taken
+                remove -= taken
+                changed.append(shard)
+
+        ndb.put_multi(changed)
+        conf.seatsAvailable = available + delta
+        return True
+
+    @staticmethod
+    def reconcile(page_token=None):
+        """Sync Conference.seatsAvailable with the shard totals for a batch of
+        dirty shards, queueing up the next batch if there are more.
+
+        Args:
+            page_token (string)
+
+        Returns:
+            bool: True if any conference was updated
+        """
+        cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+        shard_keys, next_cursor, more = SeatShard.query(
+            SeatShard.dirty == True).fetch_page(
+                RECONCILE_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # Shards are keyed by the urlsafe conference key and their index
+        c_keys = []
+        for shard_key in shard_keys:
+            c_key = ndb.Key(urlsafe=shard_key.id().rsplit(':', 1)[0])
+            if c_key not in c_keys:
+                c_keys.append(c_key)
+
+        synced = False
+        for c_key in c_keys:
+            if ShardsSeats.sync_seats_available(c_key):
+                synced = True
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url=RECONCILE_SEATS_URL)
+        return synced
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def sync_seats_available(c_key):
+        """Copy the shard total onto the conference, clearing the dirty
+        shards. Registrations after this commits mark their shard again.
+
+        Returns:
+            bool: True if seatsAvailable changed
+        """
+        conf = c_key.get()
+        if conf is None or not conf.seatShards:
+            return False
+        shards = [shard for shard in
+                  ndb.get_multi(ShardsSeats.shard_keys(conf)) if shard]
+        dirty = [shard for shard in shards if shard.dirty]
+        for shard in dirty:
+            shard.dirty = False
+
+        seats = sum(shard.seats for shard in shards)
+        changed = conf.seatsAvailable != seats
+        if changed:
+            conf.seatsAvailable = seats
+            dirty.append(conf)
+        ndb.put_multi(dirty)
+        return changed
+
+    @staticmethod
+    def audit(page_token=None):
+        """Check a batch of conferences against their registrations,
+        queueing up the next batch if there are more.
+
+        Any conference where seats and registrations no longer add up to
+        maxAttendees is logged. This is not corrected automatically, as the
+        registration count comes from an eventually consistent query.
+
+        Args:
+            page_token (string)
+        """
+        cursor = ndb.Cursor(urlsafe=page_token) if page_token else None
+        confs, next_cursor, more = Conference.query().fetch_page(
+            RECONCILE_BATCH_SIZE, start_cursor=cursor)
+
+        for conf in confs:
+            if not conf.seatShards or not conf.maxAttendees:
+                continue
+            seats = ShardsSeats(conf).available()
+            attendees = Registration.query(
+                Registration.conference == conf.key).count()
+            if seats + attendees != conf.maxAttendees:
+                logging.warning(
+                    'Seats for conference %s do not add up: %d available, '
+                    '%d registered, %d max', conf.key.urlsafe(), seats,
+                    attendees, conf.maxAttendees)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url=AUDIT_SEATS_URL)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""VerifiesTokens.py
+
+Verifies Google ID tokens locally, against Google's public keys.
+
+An ID token is a JWT signed with RS256. Its signature, issuer and expiry are
+checked with pycrypto, so no request to the tokeninfo endpoint is needed. The
+public keys are fetched rarely: they are kept in instance memory and in
+memcache for as long as Google's response allows.
+
+"""
+
+import base64
+import binascii
+import json
+import re
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from google.appengine.api import memcache
+
+from settings import WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID, \
+    ANDROID_AUDIENCE
+from support.CachesInMemory import CachesInMemory
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+MEMCACHE_CERTS_KEY = 'GOOGLE_OAUTH_CERTS'
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+# Only tokens issued to one of this app's clients identify a user here
+AUDIENCES = (WEB_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID, ANDROID_AUDIENCE)
+DEFAULT_CERTS_TTL = 60 * 60
+
+public_keys = CachesInMemory('oauth_certs', max_size=1)
+
+
+def b64url_decode(data):
+    """Decode unpadded base64url, as used in JWTs and JWKs."""
+    data = str(data)
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def issued_to_us(audience, authorized_party=None):
+    """Check whether a token was issued to one of this app's clients. The
+    audience must be one of them, and so must the authorized party, if the
+    token names one.
+
+    Args:
+        audience: the token's audience, a client id or a list of them
+        authorized_party (string): the client the token was issued to
+
+    Returns:
+        bool
+    """
+    if not isinstance(audience, list):
+        audience = [audience]
+    if not any(client_id in AUDIENCES for client_id in audience):
+        return False
+    return authorized_party is None or authorized_party in AUDIENCES
+
+
+def b64url_to_long(data):
+    """Decode a base64url big-endian integer, eg. an RSA modulus."""
+    return int(binascii.hexlify(b64url_decode(data)), 16)
+
+
+class VerifiesTokens(object):
+    """Verify ID tokens with cached public keys."""
+
+    def __init__(self, fetch):
+        """Initialize with the function fetching URLs
+
+        Args:
+            fetch (callable): takes a URL, returns (status code, content,
+                headers)
+        """
+        self.fetch = fetch
+
+    def verify(self, token):
+        """Check an ID token, returning who it identifies.
+
+        Args:
+            token (string)
+
+        Returns:
+            tuple: (user id, expiry timestamp), or None if the token can not
+                be verified locally
+        """
+        parts = token.split('.')
+        if len(parts) != 3:
+            return None
+
+        try:
+            header = json.loads(b64url_decode(parts[0]))
+            claims = json.loads(b64url_decode(parts[1]))
+            signature = b64url_decode(parts[2])
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            return None
+
+        if header.get('alg') != 'RS256':
+            return None
+        key = self.public_keys().get(header.get('kid'))
+        if key is None:
+            return None
+
+        digest = SHA256.new('%s.%s' % (parts[0], parts[1]))
+        if not PKCS1_v1_5.new(key).verify(digest, signature):
+            return None
+
+        expires = claims.get('exp', 0)
+        if claims.get('iss') not in ISSUERS or expires <= time.time():
+            return None
+        if not issued_to_us(claims.get('aud'), claims.get('azp')):
+            return None
+        return claims.get('sub', ''), expires
+
+    def public_keys(self):
+        """Return Google's public keys, by key id.
+
+        Returns:
+            dict
+        """
+        cached = public_keys.get(GOOGLE_CERTS_URL)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+
+        cached = memcache.get(MEMCACHE_CERTS_KEY)
+        if cached is None:
+            cached = self.fetch_certs()
+            if cached is None:
+                return {}
+            ttl = int(cached[1] - time.time())
+            if ttl > 0:
+                memcache.set(MEMCACHE_CERTS_KEY, cached, time=ttl)
+
+        jwks, expires = cached
+        keys = {}
+        for jwk in jwks:
+            if jwk.get('kty') == 'RSA' and 'kid' in jwk:
+                keys[jwk['kid']] = RSA.construct(
+                    (b64url_to_long(jwk['n']), b64url_to_long(jwk['e'])))
+        public_keys.set(GOOGLE_CERTS_URL, (keys, expires))
+        return keys
+
+    def fetch_certs(self):
+        """Fetch Google's public keys, and how long they can be cached.
+
+        Returns:
+            tuple: (list of JWK dicts, expiry timestamp), or None
+        """
+        status_code, content, headers = self.fetch(GOOGLE_CERTS_URL)
+        if status_code != 200:
+            return None
+        try:
+            jwks = json.loads(content)['keys']
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        ttl = DEFAULT_CERTS_TTL
+        max_age = re.search(r'max-age=(\d+)',
+                            (headers or {}).get('Cache-Control', ''))
+        if max_age:
+            ttl = int(max_age.group(1))
+        return jwks, time.time() + ttl
@@ -0,0 +1,151 @@
+import base64
+import binascii
+import hashlib
+import json
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from google.appengine.api import memcache
+
+from models.profile import Profile
+from models.user_id import UserId
+from service_test_case import ServiceTestCase
+from settings import WEB_CLIENT_ID
+from support.Auth import Auth, MEMCACHE_TOKEN_KEY
+from support.CachesPerRequest import CachesPerRequest
+from support.VerifiesTokens import GOOGLE_CERTS_URL
+
+
+def b64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def long_to_b64url(value):
+    data = '%x' % value
+    return b64url_encode(binascii.unhexlify('0' * (len(data) % 2) + data))
+
+
+class StubFetch(object):
+    """Answers URL fetches locally, counting them."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.urls = []
+
+    def __call__(self, url):
+        self.urls.append(url)
+        for prefix, response in self.responses.items():
+            if url.startswith(prefix):
+                return response
+        return 404, '', {}
+
+
+class TestAuth(ServiceTestCase):
+    def setUp(self):
+        super(TestAuth, self).setUp()
+        self.key = RSA.generate(1024)
+        certs = {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'kid': 'key1',
+                           'n': long_to_b64url(self.key.n),
+                           'e': long_to_b64url(self.key.e)}]}
+        self.fetch = StubFetch({
+            GOOGLE_CERTS_URL: (200, json.dumps(certs),
+                               {'Cache-Control': 'public, max-age=600'}),
+            'https://www.googleapis.com/oauth2/v1/tokeninfo': (
+                200, json.dumps({'user_id': '42', 'expires_in': 3600,
+                                 'audience': WEB_CLIENT_ID}), {})})
+
+    def make_id_token(self, claims, kid='key1'):
+        signing_input = '%s.%s' % (
+            b64url_encode(json.dumps({'alg': 'RS256', 'kid': kid})),
+            b64url_encode(json.dumps(claims)))
+        signature = PKCS1_v1_5.new(self.key).sign(SHA256.new(signing_input))
+        return '%s.%s' % (signing_input, b64url_encode(signature))
+
+    def test_it_verifies_id_tokens_locally_and_caches_the_user_id(self):
+        token = self.make_id_token({'iss': 'accounts.google.com',
+                                    'aud': WEB_CLIENT_ID, 'sub': '123',
+                                    'exp': int(time.time()) + 600})
+        auth = Auth(fetch=self.fetch)
+
+        self.assertEqual('123', auth.oauth_user_id(token))
+        self.assertEqual('123', auth.oauth_user_id(token))
+        self.assertEqual([GOOGLE_CERTS_URL], self.fetch.urls)
+
+    def test_it_rejects_tampered_or_expired_id_tokens(self):
+        expired = self.make_id_token({'iss': 'accounts.google.com',
+                                      'aud': WEB_CLIENT_ID, 'sub': '123',
+                                      'exp': int(time.time()) - 1})
+        header, claims, signature = self.make_id_token(
+            {'iss': 'accounts.google.com', 'aud': WEB_CLIENT_ID, 'sub': '123',
+             'exp': int(time.time()) + 600}).split('.')
+        tampered = '.'.join([header, b64url_encode(json.dumps(
+            {'iss': 'accounts.google.com', 'aud': WEB_CLIENT_ID, 'sub': '456',
+             'exp': int(time.time()) + 600})), signature])
+        auth = Auth(fetch=StubFetch({GOOGLE_CERTS_URL: self.fetch.responses[
+            GOOGLE_CERTS_URL]}))
+
+        self.assertEqual('', auth.oauth_user_id(expired))
+        self.assertEqual('', auth.oauth_user_id(tampered))
+
+    def test_it_caches_tokeninfo_results_until_the_token_expires(self):
+        auth = Auth(fetch=self.fetch)
+
+        self.assertEqual('42', auth.oauth_user_id('an-access-token'))
+        self.assertEqual('42', auth.oauth_user_id('an-access-token'))
+        self.assertEqual(1, len(self.fetch.urls))
+        token_hash = hashlib.sha1('an-access-token').hexdigest()
+        self.assertIsNotNone(memcache.get(MEMCACHE_TOKEN_KEY % token_hash))
+
+    def test_it_assigns_one_custom_user_id_per_email(self):
+        first = Auth.custom_user_id('Someone@example.com')
+        CachesPerRequest.clear()
+        memcache.flush_all()
+        second = Auth.custom_user_id('someone@example.com')
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, UserId.query().count())
+
+    def test_it_keeps_the_custom_user_id_of_existing_profiles(self):
+        Profile(id='existing-id', mainEmail='someone@example.com').put()
+
+        self.assertEqual('existing-id',
+                         Auth.custom_user_id('someone@example.com'))
+
+    def test_it_rejects_tokens_issued_to_other_clients(self):
+        token = self.make_id_token({'iss': 'accounts.google.com',
+                                    'aud': 'another-client', 'sub': '123',
+                                    'exp': int(time.time()) + 600})
+        other_client = StubFetch({
+            GOOGLE_CERTS_URL: self.fetch.responses[GOOGLE_CERTS_URL],
+            'https://www.googleapis.com/oauth2/v1/tokeninfo': (
+                200, json.dumps({'user_id': '123', 'expires_in': 600,
+                                 'audience': 'another-client'}), {})})
+        auth = Auth(fetch=other_client)
+
+        self.assertEqual('', auth.oauth_user_id(token))
+        self.assertEqual('', auth.oauth_user_id('an-access-token'))
+
+    def test_it_rejects_tokens_for_other_audiences_from_our_clients(self):
+        token = self.make_id_token({'iss': 'accounts.google.com',
+                                    'aud': 'another-service',
+                                    'azp': WEB_CLIENT_ID, 'sub': '123',
+                                    'exp': int(time.time()) + 600})
+        other_audience = StubFetch({
+            GOOGLE_CERTS_URL: self.fetch.responses[GOOGLE_CERTS_URL],
+            'https://www.googleapis.com/oauth2/v1/tokeninfo': (
+                200, json.dumps({'user_id': '123', 'expires_in': 600,
+                                 'audience': 'another-service',
+                                 'issued_to': WEB_CLIENT_ID}), {})})
+        auth = Auth(fetch=other_audience)
+
+        self.assertEqual('', auth.oauth_user_id(token))
+        self.assertEqual('', auth.oauth_user_id('an-access-token'))
+
+    def test_it_rejects_tokens_that_are_not_json_objects(self):
+        token = '%s.%s.%s' % (b64url_encode('[]'), b64url_encode('[]'),
+                              b64url_encode('signature'))
+        auth = Auth(fetch=StubFetch({}))
+
+        self.assertEqual('', auth.oauth_user_id(token))
@@ -0,0 +1,180 @@
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from protorpc import messages
+
+from models.conference import Conference, ConferenceForm, \
+    ConferenceQueryForm
+from models.profile import Profile
+from service_test_case import ServiceTestCase
+from services.conference_service import ConferenceService, \
+    conference_query_cache
+from support.CachesInMemory import CachesInMemory
+from support.CachesValues import CachesValues
+from support.ShardsSeats import ShardsSeats, SHARD_COUNT
+
+CONF_POST_REQUEST = endpoints.ResourceContainer(
+    ConferenceForm,
+    websafeConferenceKey=messages.StringField(1, required=True)
+)
+
+
+class TestConferenceService(ServiceTestCase):
+    def test_it_copies_the_organizer_name_onto_their_conferences(self):
+        email = 'kdoole@gmail.com'
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email=email)
+        other_id, _ = self.make_conference(conf_name='another conference',
+                                           email='someone@else.com')
+        profile = ndb.Key(Profile, email).get()
+        profile.displayName = 'Kevin'
+        profile.put()
+
+        ConferenceService.update_organizer_display_name(email)
+
+        conf = ndb.Key(urlsafe=conf_id).get()
+        self.assertEqual('Kevin', conf.organizerDisplayName)
+        other = ndb.Key(urlsafe=other_id).get()
+        self.assertIsNone(other.organizerDisplayName)
+
+    def test_it_returns_the_stored_organizer_name(self):
+        conf = Conference(name='a conference', organizerDisplayName='Kevin')
+        conf.put()
+
+        conference_service = ConferenceService()
+        form = conference_service.copy_conference_to_form(ConferenceForm(),
+                                                          conf)
+
+        self.assertEqual('Kevin', form.organizerDisplayName)
+
+    def test_it_never_hands_out_more_seats_than_available(self):
+        conf = Conference(name='a conference', maxAttendees=3,
+                          seatsAvailable=3)
+        conf.put()
+        ndb.put_multi(ShardsSeats.create_shards(conf, 3))
+        conf.put()
+
+        seats = ShardsSeats(conf)
+        taken = [seats.reserve(lambda: []) for _ in range(5)]
+
+        self.assertEqual([True, True, True, False, False], taken)
+        self.assertEqual(0, seats.available())
+
+        self.assertTrue(seats.release(lambda: []))
+        self.assertFalse(seats.release(lambda: None))
+        self.assertEqual(1, seats.available())
+
+    def test_it_shards_the_seats_of_existing_conferences(self):
+        conf = Conference(name='a conference', maxAttendees=50,
+                          seatsAvailable=42)
+        conf.put()
+
+        self.assertEqual(42, ShardsSeats(conf).available())
+        self.assertEqual(SHARD_COUNT, conf.key.get().seatShards)
+
+    def test_it_only_reconciles_conferences_with_registrations(self):
+        confs = []
+        for name in ('a conference', 'another conference'):
+            conf = Conference(name=name, maxAttendees=3, seatsAvailable=3)
+            conf.put()
+            ndb.put_multi(ShardsSeats.create_shards(conf, 3))
+            conf.put()
+            confs.append(conf)
+        ShardsSeats(confs[0]).reserve(lambda: [])
+        # Out of sync, but no registration marked its shards
+        confs[1].seatsAvailable = 1
+        confs[1].put()
+
+        self.assertTrue(ShardsSeats.reconcile())
+
+        self.assertEqual(2, confs[0].key.get().seatsAvailable)
+        self.assertEqual(1, confs[1].key.get().seatsAvailable)
+        self.assertFalse(ShardsSeats.reconcile())
+
+    def test_it_resizes_the_seats_when_the_capacity_changes(self):
+        email = 'kdoole@gmail.com'
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email=email)
+        conf = ndb.Key(urlsafe=conf_id).get()
+        conf.maxAttendees = conf.seatsAvailable = 3
+        ndb.put_multi([conf] + ShardsSeats.create_shards(conf, 3))
+        seats = ShardsSeats(conf)
+        seats.reserve(lambda: [])
+        seats.reserve(lambda: [])
+
+        self.loginUser(email=email)
+        conference_service = ConferenceService(auth=self.mock_auth(email))
+
+        def update(max_attendees):
+            conference_service.update_conference_object(
+                CONF_POST_REQUEST.combined_message_class(
+                    websafeConferenceKey=conf_id,
+                    maxAttendees=max_attendees))
+            return ShardsSeats(ndb.Key(urlsafe=conf_id).get()).available()
+
+        self.assertEqual(3, update(5))
+        self.assertEqual(0, update(2))
+        with self.assertRaises(endpoints.BadRequestException):
+            update(1)
+        conf = ndb.Key(urlsafe=conf_id).get()
+        self.assertEqual(2, conf.maxAttendees)
+        self.assertEqual(0, conf.seatsAvailable)
+
+    def test_it_serves_the_stale_value_while_another_request_refreshes(self):
+        values = ['first', 'second']
+        cached = CachesValues('a key', lambda: values.pop(0), soft_ttl=-1)
+
+        self.assertEqual('first', cached.get())
+        memcache.add(cached.lock_key, 1)
+        self.assertEqual('first', cached.get())
+        memcache.delete(cached.lock_key)
+        self.assertEqual('second', cached.get())
+
+    def test_it_evicts_the_least_recently_used_local_entry(self):
+        cache = CachesInMemory('test', max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual({'hits': 2, 'misses': 1, 'evictions': 1},
+                         cache.stats())
+
+    def test_it_expires_local_entries(self):
+        cache = CachesInMemory('test', ttl=-1)
+        cache.set('a', 1)
+
+        self.assertIsNone(cache.get('a'))
+
+    def test_it_caches_query_results_until_a_conference_changes(self):
+        Conference(name='a conference', city='London').put()
+        conference_service = ConferenceService()
+        filters = [ConferenceQueryForm(field='CITY', operator='EQ',
+                                       value='London')]
+
+        first = conference_service.query_conferences(filters)
+        Conference(name='another conference', city='London').put()
+        second = conference_service.query_conferences(filters)
+        ConferenceService.conferences_changed()
+        third = conference_service.query_conferences(filters)
+
+        self.assertEqual(1, len(first.items))
+        self.assertEqual(1, len(second.items))
+        self.assertEqual(2, len(third.items))
+        self.assertEqual({'hits': 1, 'misses': 2},
+                         conference_query_cache.stats())
+
+    def test_it_serves_a_cached_query_with_one_memcache_get(self):
+        conference_service = ConferenceService()
+        filters = [ConferenceQueryForm(field='CITY', operator='EQ',
+                                       value='London')]
+        conference_service.query_conferences(filters)
+
+        before = memcache.get_stats()
+        conference_service.query_conferences(filters)
+        after = memcache.get_stats()
+
+        self.assertEqual(1, after['hits'] - before['hits'])
+        self.assertEqual(before['misses'], after['misses'])
@@ -1,12 +1,24 @@
 import unittest
 
+from auth_test import TestAuth
+from conference_service_test import TestConferenceService
+from migrates_entities_test import TestMigratesEntities
+from registration_service_test import TestRegistrationService
 from session_service_test import TestSessionService
 from speaker_service_test import TestSpeakerService
 from wishlist_service_test import TestWishlistService
 
+auth = unittest.TestLoader().loadTestsFromTestCase(TestAuth)
+conference = unittest.TestLoader().loadTestsFromTestCase(
+    TestConferenceService)
+migrations = unittest.TestLoader().loadTestsFromTestCase(
+    TestMigratesEntities)
+registration = unittest.TestLoader().loadTestsFromTestCase(
+    TestRegistrationService)
 session = unittest.TestLoader().loadTestsFromTestCase(TestSessionService)
 speaker = unittest.TestLoader().loadTestsFromTestCase(TestSpeakerService)
-wishist = unittest.TestLoader().loadTestsFromTestCase(TestWishlistService)
+wishlist = unittest.TestLoader().loadTestsFromTestCase(TestWishlistService)
 
-allTests = unittest.TestSuite([session, speaker])
+allTests = unittest.TestSuite([auth, conference, migrations, registration,
+                               session, speaker, wishlist])
 unittest.TextTestRunner(verbosity=2).run(allTests)
@@ -0,0 +1,148 @@
+import datetime
+
+import webapp2
+from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+from models.conference_session import ConferenceSession
+from models.profile import Profile
+from models.registration import Registration
+from models.speaker import Speaker
+from models.wishlist import Wishlist, WISHLIST_ID
+from service_test_case import ServiceTestCase
+from support.MigratesEntities import MigratesEntities, MIGRATE_ENTITIES_URL
+
+
+def put_legacy(kind, parent=None, name=None, **values):
+    """Write an entity as the old models stored it, bypassing the current
+    ndb models."""
+    entity = datastore.Entity(
+        kind, parent=parent.to_old_key() if parent else None, name=name)
+    entity.update(values)
+    return ndb.Key.from_old_key(datastore.Put(entity))
+
+
+def stored(key):
+    """Read back the raw stored properties of an entity."""
+    try:
+        return dict(datastore.Get(key.to_old_key()))
+    except datastore_errors.EntityNotFoundError:
+        return None
+
+
+class TestMigratesEntities(ServiceTestCase):
+    def run_steps(self, *steps):
+        for step in steps:
+            request = webapp2.Request.blank(MIGRATE_ENTITIES_URL,
+                                            POST={'step': step})
+            MigratesEntities(request, webapp2.Response()).post()
+        ndb.get_context().clear_cache()
+
+    def assert_rerun_changes_nothing(self, steps, keys):
+        before = [stored(key) for key in keys]
+        self.run_steps(*steps)
+        self.assertEqual(before, [stored(key) for key in keys])
+
+    def make_legacy_session(self, c_key, speaker_keys):
+        return put_legacy('ConferenceSession', parent=c_key,
+                          title='A session',
+                          dateTime=datetime.datetime(2016, 12, 12, 10),
+                          speakerKeys=speaker_keys)
+
+    def test_it_moves_urlsafe_session_speakers_to_keys(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='kdoole@gmail.com')
+        speaker_key = Speaker(email='a.speaker@test.com',
+                              id='a.speaker@test.com').put()
+        s_key = self.make_legacy_session(ndb.Key(urlsafe=conf_id),
+                                         [speaker_key.urlsafe()])
+
+        self.run_steps('session_speaker_keys')
+
+        self.assertEqual([speaker_key], s_key.get().speakerKeys)
+        self.assertNotIn('speakerKeys', stored(s_key))
+        self.assert_rerun_changes_nothing(['session_speaker_keys'], [s_key])
+
+    def test_it_rekeys_speakers_by_email(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='kdoole@gmail.com')
+        old_key = put_legacy('Speaker', email='A.Speaker@Test.com',
+                             name='A Speaker')
+        session = ConferenceSession(parent=ndb.Key(urlsafe=conf_id),
+                                    title='A session',
+                                    dateTime=datetime.datetime(2016, 12, 12),
+                                    speakerKeys=[old_key])
+        s_key = session.put()
+
+        steps = ['speaker_email_keys', 'session_speaker_email_keys',
+                 'speaker_old_keys']
+        self.run_steps(*steps)
+
+        new_key = ndb.Key(Speaker, 'a.speaker@test.com')
+        self.assertEqual('A Speaker', new_key.get().name)
+        self.assertEqual([new_key], s_key.get().speakerKeys)
+        self.assertIsNone(old_key.get())
+        self.assert_rerun_changes_nothing(steps, [new_key, s_key])
+
+    def test_it_keeps_old_speakers_that_sessions_still_use(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='kdoole@gmail.com')
+        old_key = put_legacy('Speaker', email='a.speaker@test.com')
+        s_key = ConferenceSession(parent=ndb.Key(urlsafe=conf_id),
+                                  title='A session',
+                                  dateTime=datetime.datetime(2016, 12, 12),
+                                  speakerKeys=[old_key]).put()
+
+        self.run_steps('speaker_email_keys', 'speaker_old_keys')
+
+        self.assertIsNotNone(old_key.get())
+        self.assertEqual([old_key], s_key.get().speakerKeys)
+
+    def test_it_moves_legacy_wishlists_to_the_fixed_id(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='kdoole@gmail.com')
+        s_key = self.make_legacy_session(ndb.Key(urlsafe=conf_id), [])
+        p_key = ndb.Key(Profile, 'attendee@example.com')
+        old_key = put_legacy('Wishlist', parent=p_key,
+                             sessionKeys=[s_key.urlsafe()])
+
+        steps = ['wishlist_session_keys', 'wishlist_ids']
+        self.run_steps(*steps)
+
+        wl_key = ndb.Key(Wishlist, WISHLIST_ID, parent=p_key)
+        self.assertEqual([s_key], wl_key.get().sessionKeys)
+        self.assertNotIn('sessionKeys', stored(wl_key))
+        self.assertIsNone(stored(old_key))
+        self.assert_rerun_changes_nothing(steps, [wl_key])
+
+    def test_it_moves_profile_conferences_to_registrations(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='kdoole@gmail.com')
+        p_key = put_legacy('Profile', name='attendee@example.com',
+                           mainEmail='attendee@example.com',
+                           conferenceKeysToAttend=[conf_id])
+
+        steps = ['profile_conference_keys', 'profile_registrations']
+        self.run_steps(*steps)
+
+        c_key = ndb.Key(urlsafe=conf_id)
+        registration = ndb.Key(Registration, conf_id, parent=p_key).get()
+        self.assertEqual(c_key, registration.conference)
+        self.assertEqual([], p_key.get().conferenceKeysToAttend)
+        self.assertNotIn('conferenceKeysToAttend', stored(p_key))
+        self.assert_rerun_changes_nothing(steps, [p_key, registration.key])
+
+    def test_it_copies_organizer_names_onto_conferences(self):
+        conf_id, p_key = self.make_conference(conf_name='a conference',
+                                              email='kdoole@gmail.com')
+        profile = p_key.get()
+        profile.displayName = 'Kevin'
+        profile.put()
+
+        self.run_steps('conference_organizer_names')
+
+        c_key = ndb.Key(urlsafe=conf_id)
+        self.assertEqual('Kevin', c_key.get().organizerDisplayName)
+        self.assert_rerun_changes_nothing(['conference_organizer_names'],
+                                          [c_key])
@@ -0,0 +1,158 @@
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models.conference import Conference
+from models.models import ConflictException
+from models.profile import Profile
+from models.registration import Registration
+from service_test_case import ServiceTestCase
+from services.profile_service import ProfileService
+from services.registration_service import RegistrationService
+from support.AnnouncesConferences import AnnouncesConferences
+from support.CachesValues import local_values
+from support.LoadsProfiles import LoadsProfiles
+from support.ShardsSeats import ShardsSeats
+
+
+class TestRegistrationService(ServiceTestCase):
+    def make_service(self, email):
+        self.loginUser(email=email)
+        registration_service = RegistrationService(
+            auth=self.mock_auth(email))
+        registration_service.profile_service.auth = self.mock_auth(email)
+        return registration_service
+
+    def make_seats(self, conf_id, seats):
+        conf = ndb.Key(urlsafe=conf_id).get()
+        conf.maxAttendees = conf.seatsAvailable = seats
+        ndb.put_multi([conf] + ShardsSeats.create_shards(conf, seats))
+
+    def test_it_registers_a_user_for_a_conference(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='organizer@example.com')
+        self.make_seats(conf_id, 10)
+        registration_service = self.make_service('attendee@example.com')
+
+        registration_service.conference_registration(conf_id)
+
+        c_key = ndb.Key(urlsafe=conf_id)
+        p_key = ndb.Key(Profile, 'attendee@example.com')
+        self.assertEqual([c_key],
+                         ProfileService.conference_keys_to_attend(p_key))
+        self.assertEqual(9, ShardsSeats(c_key.get()).available())
+
+        forms = registration_service.get_conferences_to_attend()
+        self.assertEqual(['a conference'], [form.name for form in forms.items])
+
+        self.assertRaises(ConflictException,
+                          registration_service.conference_registration,
+                          conf_id)
+        self.assertEqual(9, ShardsSeats(c_key.get()).available())
+
+    def test_it_unregisters_a_user_from_a_conference(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='organizer@example.com')
+        self.make_seats(conf_id, 10)
+        registration_service = self.make_service('attendee@example.com')
+        registration_service.conference_registration(conf_id)
+
+        removed = registration_service.conference_registration(conf_id,
+                                                               reg=False)
+        again = registration_service.conference_registration(conf_id,
+                                                             reg=False)
+
+        self.assertTrue(removed.data)
+        self.assertFalse(again.data)
+        self.assertEqual(0, Registration.query().count())
+        c_key = ndb.Key(urlsafe=conf_id)
+        self.assertEqual(10, ShardsSeats(c_key.get()).available())
+
+    def test_it_rejects_registering_for_keys_of_other_kinds(self):
+        _, p_key = self.make_conference(conf_name='a conference',
+                                        email='organizer@example.com')
+        registration_service = self.make_service('attendee@example.com')
+
+        self.assertRaises(endpoints.NotFoundException,
+                          registration_service.conference_registration,
+                          p_key.urlsafe())
+
+    def test_it_lists_attendees_to_the_organizer_only(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='organizer@example.com')
+        c_key = ndb.Key(urlsafe=conf_id)
+        emails = ['a@example.com', 'b@example.com', 'c@example.com']
+        ndb.put_multi([
+            Registration(id=conf_id, parent=ndb.Key(Profile, email),
+                         conference=c_key) for email in emails])
+        other_key = Conference(name='another conference').put()
+        Registration(id=other_key.urlsafe(),
+                     parent=ndb.Key(Profile, 'd@example.com'),
+                     conference=other_key).put()
+
+        registration_service = self.make_service('organizer@example.com')
+        first = registration_service.get_attendees(conf_id, page_size=2)
+        second = registration_service.get_attendees(
+            conf_id, page_size=2, page_token=first.nextPageToken)
+
+        self.assertEqual(2, len(first.userIds))
+        self.assertEqual(sorted(emails),
+                         sorted(first.userIds + second.userIds))
+        self.assertIsNone(second.nextPageToken)
+
+        other_service = self.make_service('a@example.com')
+        self.assertRaises(endpoints.ForbiddenException,
+                          other_service.get_attendees, conf_id)
+
+    def test_it_announces_conferences_as_they_nearly_sell_out(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='organizer@example.com')
+        self.make_seats(conf_id, 6)
+        self.make_service('first@example.com').conference_registration(
+            conf_id)
+
+        self.assertIn('a conference', AnnouncesConferences.get())
+
+        self.make_service('first@example.com').conference_registration(
+            conf_id, reg=False)
+
+        self.assertEqual('', AnnouncesConferences.get())
+
+    def test_it_reconciles_the_announcement_with_the_seat_shards(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='organizer@example.com')
+        self.make_seats(conf_id, 3)
+
+        self.assertEqual('', AnnouncesConferences.get())
+        self.assertIn('a conference', AnnouncesConferences.reconcile())
+        self.assertIn('a conference', AnnouncesConferences.get())
+
+    def test_it_rebuilds_the_announcement_after_eviction(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='organizer@example.com')
+        self.make_seats(conf_id, 6)
+        self.make_service('first@example.com').conference_registration(
+            conf_id)
+
+        memcache.flush_all()
+        local_values.clear()
+
+        self.assertIn('a conference', AnnouncesConferences.get())
+
+    def test_it_reads_the_profile_once_per_request(self):
+        registration_service = self.make_service('attendee@example.com')
+        profile_service = registration_service.profile_service
+        profile = profile_service.get_profile_from_user()
+
+        # Written behind the memo's back, so only a fresh read would see it
+        changed = ndb.Key(Profile, 'attendee@example.com').get(
+            use_cache=False)
+        changed.displayName = 'Changed'
+        changed.put(use_cache=False)
+
+        self.assertIs(profile, profile_service.get_profile_from_user())
+
+        profile.displayName = 'Saved'
+        LoadsProfiles.put(profile)
+        self.assertEqual('Saved',
+                         profile_service.get_profile_from_user().displayName)
@@ -10,6 +10,9 @@ from models.conference import Conference
 from models.profile import Profile
 
 from support.Auth import Auth
+from support.CachesInMemory import CachesInMemory
+from support.CachesQueries import CachesQueries
+from support.CachesPerRequest import CachesPerRequest
 
 
 class ServiceTestCase(unittest.TestCase):
@@ -29,6 +32,11 @@ class ServiceTestCase(unittest.TestCase):
         # Alternatively, you could disable caching by
         # using ndb.get_context().set_cache_policy(False)
         ndb.get_context().clear_cache()
+        # Likewise for the caches held in instance memory.
+        for cache in CachesInMemory.caches.values():
+            cache.clear()
+        CachesPerRequest.clear()
+        CachesQueries.counters.clear()
 
     def tearDown(self):
         self.testbed.deactivate()
@@ -1,14 +1,25 @@
 import datetime
 
 import endpoints
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from mock import patch
 
 from models.conference import Conference
-from models.conference_session import ConferenceSessionForm, ConferenceSession
+from models.conference_session import ConferenceSessionForm, \
+    ConferenceSession, ConferenceSessionQueryForm
 from models.profile import Profile
+from models.speaker import Speaker
+from models.speaker_session_counts import SpeakerSessionCounts, \
+    SPEAKER_COUNTS_ID
 from service_test_case import ServiceTestCase
 from services.session_service import SessionService
 from services.speaker_service import SpeakerService
+from support.CachesValues import local_values
+from support.FeaturesSpeakers import FeaturesSpeakers, \
+    get_featured_speaker, FEATURE_SPEAKER_URL
 
 
 class TestSessionService(ServiceTestCase):
@@ -39,7 +50,7 @@ class TestSessionService(ServiceTestCase):
         self.assertEqual(1, len(ConferenceSession.query().fetch(2)))
 
         session = ConferenceSession.query(
-            ConferenceSession.websafeConferenceKey == conf_id).fetch()
+            ancestor=ndb.Key(urlsafe=conf_id)).fetch()
 
         self.assertEquals(data['title'], session[0].title)
         self.assertEquals(data['highlights'], session[0].highlights)
@@ -48,7 +59,7 @@ class TestSessionService(ServiceTestCase):
         self.assertEquals(datetime.datetime(2016, 12, 12, 13, 15),
                           session[0].dateTime)
 
-        speaker = ndb.Key(urlsafe=session[0].speakerKeys[0]).get()
+        speaker = session[0].speakerKeys[0].get()
         self.assertEquals(speaker.email, 'test@mail.com')
 
     def test_only_owners_can_create_sessions(self):
@@ -77,6 +88,7 @@ class TestSessionService(ServiceTestCase):
             dateTime=datetime.datetime(2016, 12, 12, 13, 15),
             highlights="blah blah ha",
             websafeConferenceKey=conf_id,
+            parent=ndb.Key(urlsafe=conf_id),
             duration=12,
             typeOfSession='snails'
         ).put().urlsafe()
@@ -85,6 +97,7 @@ class TestSessionService(ServiceTestCase):
             dateTime=datetime.datetime(2017, 12, 12, 23, 32),
             highlights="blah hahahaha blah ha",
             websafeConferenceKey=conf_id,
+            parent=ndb.Key(urlsafe=conf_id),
             duration=1,
             typeOfSession='snails'
         ).put().urlsafe()
@@ -101,6 +114,7 @@ class TestSessionService(ServiceTestCase):
             dateTime=datetime.datetime(2016, 12, 12, 13, 15),
             highlights="blah blah ha",
             websafeConferenceKey=conf_id,
+            parent=ndb.Key(urlsafe=conf_id),
             duration=12,
             typeOfSession='dance'
         ).put().urlsafe()
@@ -109,6 +123,7 @@ class TestSessionService(ServiceTestCase):
             dateTime=datetime.datetime(2017, 12, 12, 23, 32),
             highlights="blah hahahaha blah ha",
             websafeConferenceKey=conf_id,
+            parent=ndb.Key(urlsafe=conf_id),
             duration=1,
             typeOfSession='snails'
         ).put().urlsafe()
@@ -119,26 +134,266 @@ class TestSessionService(ServiceTestCase):
 
     def test_it_can_find_speaker_sessions(self):
         # Make two sessions by the same speaker at 2 separate conferences.
-        websafe_speaker_key = SpeakerService.find_or_create('test@mail.com')
-        websafe_speaker_key_2 = SpeakerService.find_or_create('test2@mail2.com')
+        speaker_key = SpeakerService.find_or_create('test@mail.com')
+        speaker_key_2 = SpeakerService.find_or_create('test2@mail2.com')
         conf_id = Conference(name="a conference").put().urlsafe()
         ConferenceSession(
             title='This is the title',
             dateTime=datetime.datetime(2016, 12, 12, 13, 15),
             websafeConferenceKey=conf_id,
-            speakerKeys=[websafe_speaker_key, websafe_speaker_key_2]
+            parent=ndb.Key(urlsafe=conf_id),
+            speakerKeys=[speaker_key, speaker_key_2]
         ).put().urlsafe()
         conf_id_2 = Conference(name="another conference").put().urlsafe()
         ConferenceSession(
             title='This is another title',
             dateTime=datetime.datetime(2016, 12, 12, 13, 15),
             websafeConferenceKey=conf_id_2,
-            speakerKeys=[websafe_speaker_key]
+            parent=ndb.Key(urlsafe=conf_id_2),
+            speakerKeys=[speaker_key]
         ).put().urlsafe()
 
         session_service = SessionService()
-        sessions = session_service.get_speaker_sessions(websafe_speaker_key)
+        sessions = session_service.get_speaker_sessions(speaker_key.urlsafe())
         self.assertEqual(2, len(sessions.items))
 
-        sessions = session_service.get_speaker_sessions(websafe_speaker_key_2)
+        sessions = session_service.get_speaker_sessions(
+            speaker_key_2.urlsafe())
         self.assertEqual(1, len(sessions.items))
+
+    def test_it_resolves_speaker_emails_for_many_sessions(self):
+        speaker_key = SpeakerService.find_or_create('test@mail.com')
+        speaker_key_2 = SpeakerService.find_or_create('test2@mail2.com')
+        conf_id = Conference(name="a conference").put().urlsafe()
+        sessions = [
+            ConferenceSession(
+                title='This is the title',
+                dateTime=datetime.datetime(2016, 12, 12, 13, 15),
+                websafeConferenceKey=conf_id,
+                parent=ndb.Key(urlsafe=conf_id),
+                speakerKeys=[speaker_key, speaker_key_2]),
+            ConferenceSession(
+                title='This is another title',
+                dateTime=datetime.datetime(2016, 12, 12, 14, 15),
+                websafeConferenceKey=conf_id,
+                parent=ndb.Key(urlsafe=conf_id),
+                speakerKeys=[speaker_key_2])]
+        ndb.put_multi(sessions)
+
+        session_service = SessionService()
+        forms = session_service.copy_sessions_to_forms(sessions)
+
+        self.assertEqual(['test@mail.com', 'test2@mail2.com'],
+                         forms.items[0].speakerEmails)
+        self.assertEqual(['test2@mail2.com'], forms.items[1].speakerEmails)
+
+    def test_it_pages_through_conference_sessions(self):
+        session_service = SessionService()
+
+        conf_id = Conference(name="a conference").put().urlsafe()
+        for hour in (9, 10, 11):
+            ConferenceSession(
+                title='Session at %d' % hour,
+                dateTime=datetime.datetime(2016, 12, 12, hour, 0),
+                websafeConferenceKey=conf_id,
+                parent=ndb.Key(urlsafe=conf_id)
+            ).put()
+
+        first = session_service.get_conference_sessions(conf_id, page_size=2)
+        self.assertEqual(2, len(first.items))
+        self.assertIsNotNone(first.nextPageToken)
+
+        second = session_service.get_conference_sessions(
+            conf_id, page_size=2, page_token=first.nextPageToken)
+        self.assertEqual(1, len(second.items))
+        self.assertIsNone(second.nextPageToken)
+
+    def test_it_rejects_invalid_page_tokens(self):
+        session_service = SessionService()
+        conf_id = Conference(name="a conference").put().urlsafe()
+
+        self.assertRaises(
+            endpoints.BadRequestException,
+            session_service.get_conference_sessions, conf_id, 2, 'not-a-token')
+
+    def test_it_filters_sessions_by_type_in_the_query(self):
+        session_service = SessionService()
+
+        conf_id = Conference(name="a conference").put().urlsafe()
+        for session_type in ('dance', 'snails', 'dance'):
+            ConferenceSession(
+                title='A %s session' % session_type,
+                dateTime=datetime.datetime(2016, 12, 12, 13, 15),
+                websafeConferenceKey=conf_id,
+                parent=ndb.Key(urlsafe=conf_id),
+                typeOfSession=session_type
+            ).put()
+
+        sessions = session_service.get_sessions_by_type_and_filters(
+            conf_id, 'dance', [], page_size=1)
+        self.assertEqual(1, len(sessions.items))
+        self.assertEqual('dance', sessions.items[0].typeOfSession)
+        self.assertIsNotNone(sessions.nextPageToken)
+
+    def test_it_caches_conference_sessions_until_a_session_is_added(self):
+        auth = self.mock_auth('kdoole@gmail.com')
+        session_service = SessionService(auth=auth)
+        conf_id, profile = self.make_conference(conf_name='a conference',
+                                                email='kdoole@gmail.com')
+        request = ConferenceSessionForm(
+            title='This is the title',
+            date="2016-12-12",
+            startTime="13:15",
+            websafeConferenceKey=conf_id,
+        )
+        session_service.create_conference_session(request, profile)
+
+        self.assertEqual(
+            1, len(session_service.get_conference_sessions(conf_id).items))
+        self.assertEqual(
+            1, len(session_service.get_conference_sessions(conf_id).items))
+        self.assertEqual({'hits': 1, 'misses': 1},
+                         session_service.schedule_cache.stats())
+
+        session_service.create_conference_session(request, profile)
+        self.assertEqual(
+            2, len(session_service.get_conference_sessions(conf_id).items))
+
+    def test_it_creates_sessions_in_bulk(self):
+        auth = self.mock_auth('kdoole@gmail.com')
+        session_service = SessionService(auth=auth)
+        conf_id, profile = self.make_conference(conf_name='a conference',
+                                                email='kdoole@gmail.com')
+        requests = [
+            ConferenceSessionForm(title='Session %d' % i, date="2016-12-12",
+                                  startTime="1%d:00" % i,
+                                  speakerEmails=['test@mail.com'])
+            for i in range(3)]
+
+        keys = session_service.create_conference_sessions(conf_id, requests,
+                                                          profile)
+
+        self.assertEqual(3, len(set(keys)))
+        sessions = ConferenceSession.query(
+            ancestor=ndb.Key(urlsafe=conf_id)).fetch()
+        self.assertEqual(3, len(sessions))
+        self.assertEqual(1, len(Speaker.query().fetch(10)))
+
+    def test_it_counts_sessions_per_speaker(self):
+        auth = self.mock_auth('kdoole@gmail.com')
+        session_service = SessionService(auth=auth)
+        conf_id, profile = self.make_conference(conf_name='a conference',
+                                                email='kdoole@gmail.com')
+        c_key = ndb.Key(urlsafe=conf_id)
+        # A session from before the counts existed
+        ConferenceSession(
+            title='Old session', dateTime=datetime.datetime(2016, 12, 12),
+            speakerKeys=[SpeakerService.speaker_key('test@mail.com')],
+            parent=c_key).put()
+
+        for emails in (['test@mail.com'], ['Test@mail.com', 'b@mail.com']):
+            session_service.create_conference_sessions(
+                conf_id, [ConferenceSessionForm(
+                    title='Session', date="2016-12-12", startTime="10:00",
+                    speakerEmails=emails)], profile)
+
+        counts = ndb.Key(SpeakerSessionCounts, SPEAKER_COUNTS_ID,
+                         parent=c_key).get()
+        self.assertEqual({'test@mail.com': 3, 'b@mail.com': 1},
+                         counts.counts)
+
+    def test_it_stores_the_featured_speaker_of_each_conference(self):
+        auth = self.mock_auth('kdoole@gmail.com')
+        session_service = SessionService(auth=auth)
+        conf_id, profile = self.make_conference(conf_name='a conference',
+                                                email='kdoole@gmail.com')
+        other_id, _ = self.make_conference(conf_name='another conference',
+                                           email='kdoole@gmail.com')
+        session_service.create_conference_sessions(
+            conf_id, [ConferenceSessionForm(
+                title=title, date="2016-12-12", startTime="10:00",
+                speakerEmails=['test@mail.com']) for title in ('B', 'A')],
+            profile)
+        c_key = ndb.Key(urlsafe=conf_id)
+
+        FeaturesSpeakers.feature(c_key,
+                                 SpeakerService.speaker_key('test@mail.com'))
+        memcache.flush_all()
+        local_values.clear()
+
+        featured = get_featured_speaker(c_key)
+        self.assertEqual('test@mail.com', featured.email)
+        self.assertEqual(['A', 'B'], featured.sessionTitles)
+        other = get_featured_speaker(ndb.Key(urlsafe=other_id))
+        self.assertIsNone(other.websafeSpeakerKey)
+
+    def test_it_queues_one_featured_speaker_update_per_burst(self):
+        auth = self.mock_auth('kdoole@gmail.com')
+        session_service = SessionService(auth=auth)
+        conf_id, profile = self.make_conference(conf_name='a conference',
+                                                email='kdoole@gmail.com')
+        for title in ('A', 'B', 'C'):
+            session_service.create_conference_sessions(
+                conf_id, [ConferenceSessionForm(
+                    title=title, date="2016-12-12", startTime="10:00",
+                    speakerEmails=['test@mail.com'])], profile)
+
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        tasks = taskqueue_stub.get_filtered_tasks(url=FEATURE_SPEAKER_URL)
+        self.assertEqual(1, len(tasks))
+
+    def test_it_queues_the_featured_speaker_again_after_a_failure(self):
+        conf_id, _ = self.make_conference(conf_name='a conference',
+                                          email='kdoole@gmail.com')
+        c_key = ndb.Key(urlsafe=conf_id)
+
+        with patch.object(taskqueue, 'add',
+                          side_effect=taskqueue.TransientError):
+            FeaturesSpeakers.schedule(c_key)
+        FeaturesSpeakers.schedule(c_key)
+
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        tasks = taskqueue_stub.get_filtered_tasks(url=FEATURE_SPEAKER_URL)
+        self.assertEqual(1, len(tasks))
+
+    def test_it_validates_every_session_before_creating_any(self):
+        auth = self.mock_auth('kdoole@gmail.com')
+        session_service = SessionService(auth=auth)
+        conf_id, profile = self.make_conference(conf_name='a conference',
+                                                email='kdoole@gmail.com')
+        requests = [
+            ConferenceSessionForm(title='Session', date="2016-12-12",
+                                  startTime="10:00"),
+            ConferenceSessionForm(title='No start time', date="2016-12-12")]
+
+        self.assertRaises(
+            endpoints.BadRequestException,
+            session_service.create_conference_sessions, conf_id, requests,
+            profile)
+        self.assertEqual(0, len(ConferenceSession.query().fetch(10)))
+
+    def test_it_filters_sessions_on_two_inequalities(self):
+        session_service = SessionService()
+
+        conf_id = Conference(name="a conference").put().urlsafe()
+        for hour, duration in ((9, 30), (11, 90), (15, 90)):
+            ConferenceSession(
+                title='Session at %d' % hour,
+                dateTime=datetime.datetime(2016, 12, 12, hour, 0),
+                websafeConferenceKey=conf_id,
+                parent=ndb.Key(urlsafe=conf_id),
+                duration=duration,
+                hour=hour,
+                typeOfSession='talk'
+            ).put()
+
+        filters = [
+            ConferenceSessionQueryForm(field='HOUR', operator='LT',
+                                       value='14'),
+            ConferenceSessionQueryForm(field='DURATION', operator='GT',
+                                       value='60')]
+        sessions = session_service.get_sessions_by_type_and_filters(
+            conf_id, 'talk', filters)
+
+        self.assertEqual(1, len(sessions.items))
+        self.assertEqual('Session at 11', sessions.items[0].title)
@@ -25,3 +25,20 @@ class TestSpeakerService(ServiceTestCase):
 
         speakers = Speaker.query(Speaker.email == speaker1.email).fetch(10)
         self.assertEqual(1, len(speakers))
+
+    def test_it_keys_speakers_by_normalized_email(self):
+        key = SpeakerService.find_or_create(' Me@Whatever.com ')
+
+        self.assertEqual('me@whatever.com', key.id())
+        self.assertEqual(key, SpeakerService.find_or_create('me@whatever.com'))
+        self.assertEqual(1, len(Speaker.query().fetch(10)))
+
+    def test_it_finds_and_creates_many_speakers_at_once(self):
+        existing = SpeakerService.find_or_create('me@whatever.com')
+
+        keys = SpeakerService.find_or_create_many(
+            ['you@whatever.com', 'me@whatever.com', 'YOU@whatever.com'])
+
+        self.assertEqual(2, len(keys))
+        self.assertEqual(existing, keys[1])
+        self.assertEqual(2, len(Speaker.query().fetch(10)))
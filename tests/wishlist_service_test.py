@@ -1,10 +1,19 @@
 from google.appengine.api import users
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from mock import patch
 
 from models.conference_session import ConferenceSessionForm
+from models.models import ConflictException
+from models.session_co_occurrence import SessionCoOccurrence
+from models.session_recommendations import SessionRecommendations
+from models.wishlist import Wishlist
 from service_test_case import ServiceTestCase
 from services.session_service import SessionService
 from services.speaker_service import SpeakerService
 from services.wishlist_service import WishlistService
+from support.RecommendsSessions import RecommendsSessions, \
+    BUILD_RECOMMENDATIONS_URL
 
 
 class TestWishlistService(ServiceTestCase):
@@ -12,9 +21,10 @@ class TestWishlistService(ServiceTestCase):
         wishlist_service = WishlistService()
         self.loginUser('test@example.com')
         user = users.get_current_user()
-        wishlist = wishlist_service.get_wishlist_key(user).get()
+        wishlist = wishlist_service.get_wishlist(user)
         self.assertIsNotNone(wishlist)
-        should_be_same_wishlist = wishlist_service.get_wishlist_key(user).get()
+        self.assertEqual([], wishlist.sessionKeys)
+        should_be_same_wishlist = wishlist_service.get_wishlist(user)
         self.assertEqual(wishlist, should_be_same_wishlist)
 
     def test_it_saves_and_removes_sessions_to_the_wishlist(self):
@@ -24,12 +34,28 @@ class TestWishlistService(ServiceTestCase):
         wishlist_service.add_session_to_wishlist(websafe_session_key, user)
         wishlist = wishlist_service.get_wishlist_key(user).get()
 
-        self.assertIn(websafe_session_key, wishlist.sessionKeys)
+        self.assertIn(ndb.Key(urlsafe=websafe_session_key),
+                      wishlist.sessionKeys)
 
         wishlist_service.remove_session_from_wishlist(websafe_session_key, user)
         wishlist = wishlist_service.get_wishlist_key(user).get()
 
-        self.assertNotIn(websafe_session_key, wishlist.sessionKeys)
+        self.assertNotIn(ndb.Key(urlsafe=websafe_session_key),
+                         wishlist.sessionKeys)
+
+    def test_it_rejects_duplicate_and_missing_wishlist_sessions(self):
+        user, websafe_session_key = self.make_conference_and_session()
+
+        wishlist_service = WishlistService()
+        self.assertRaises(ConflictException,
+                          wishlist_service.remove_session_from_wishlist,
+                          websafe_session_key, user)
+        wishlist_service.add_session_to_wishlist(websafe_session_key, user)
+        self.assertRaises(ConflictException,
+                          wishlist_service.add_session_to_wishlist,
+                          websafe_session_key, user)
+
+        self.assertEqual(1, Wishlist.query().count())
 
     def test_it_lists_sessions_in_wishlist(self):
         user, websafe_session_key = self.make_conference_and_session()
@@ -69,6 +95,86 @@ class TestWishlistService(ServiceTestCase):
         self.assertEqual(1, len(sessions.items))
         self.assertEquals('This is the title', data['title'])
 
+    def test_it_pages_sessions_by_wishlist_speakers_without_duplicates(self):
+        user, websafe_session_key = self.make_conference_and_session()
+        conf_id = ndb.Key(urlsafe=websafe_session_key).parent().urlsafe()
+        session_service = SessionService()
+        for title in ('Second', 'Third'):
+            other_key = session_service.create_conference_session(
+                ConferenceSessionForm(
+                    title=title, date="2016-12-13", typeOfSession="lecture",
+                    startTime="10:00", websafeConferenceKey=conf_id,
+                    speakerEmails=['a.speaker@test.com',
+                                   'another.speaker@test.com']),
+                user)
+
+        wishlist_service = WishlistService()
+        wishlist_service.add_session_to_wishlist(websafe_session_key, user)
+        wishlist_service.add_session_to_wishlist(other_key, user)
+
+        first = wishlist_service.get_sessions_by_speaker_in_wishlist(
+            user, page_size=2)
+        second = wishlist_service.get_sessions_by_speaker_in_wishlist(
+            user, page_size=2, page_token=first.nextPageToken)
+
+        titles = [s.title for s in first.items + second.items]
+        self.assertEqual(['Second', 'Third', 'This is the title'],
+                         sorted(titles))
+        self.assertIsNone(second.nextPageToken)
+
+    def test_it_recommends_sessions_wishlisted_together(self):
+        user, first_key = self.make_conference_and_session()
+        conf_id = ndb.Key(urlsafe=first_key).parent().urlsafe()
+        session_service = SessionService()
+        others = [session_service.create_conference_session(
+            ConferenceSessionForm(
+                title=title, date="2016-12-13", typeOfSession="lecture",
+                startTime="10:00", websafeConferenceKey=conf_id,
+                speakerEmails=['a.speaker@test.com']), user)
+            for title in ('Often together', 'Once together', 'Never')]
+
+        wishlists = [[first_key, others[0], others[1]],
+                     [first_key, others[0]],
+                     [others[2]]]
+        for index, session_keys in enumerate(wishlists):
+            self.loginUser('user%d@example.com' % index)
+            wishlist_user = users.get_current_user()
+            wishlist_service = WishlistService(
+                auth=self.mock_auth('user%d@example.com' % index))
+            for websafe_session_key in session_keys:
+                wishlist_service.add_session_to_wishlist(websafe_session_key,
+                                                         wishlist_user)
+
+        stale = SessionRecommendations(id='a deleted conference').put()
+
+        # One wishlist per task, so the counts add up across tasks
+        with patch('support.RecommendsSessions.BATCH_SIZE', 1):
+            RecommendsSessions.start()
+            self.run_recommendation_tasks()
+
+        recommended = session_service.get_recommended_sessions(first_key)
+        self.assertEqual(['Often together', 'Once together'],
+                         [s.title for s in recommended.items])
+        self.assertEqual(
+            [], session_service.get_recommended_sessions(others[2]).items)
+        self.assertIsNone(stale.get())
+        self.assertIsNotNone(SessionRecommendations.get_by_id(conf_id))
+        self.assertEqual(0, SessionCoOccurrence.query().count())
+
+    def run_recommendation_tasks(self):
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        done = 0
+        while True:
+            tasks = taskqueue_stub.get_filtered_tasks(
+                url=BUILD_RECOMMENDATIONS_URL)
+            if len(tasks) == done:
+                return
+            for task in tasks[done:]:
+                params = task.extract_params()
+                RecommendsSessions.run(params['step'], params['started'],
+                                       params.get('cursor'))
+            done = len(tasks)
+
     def make_conference_and_session(self):
         email = 'kdoole@gmail.com'
         self.loginUser(email)